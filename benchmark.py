@@ -0,0 +1,591 @@
+#!/usr/bin/python3.5 -p
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import tempfile
+import time
+import threading
+from datetime import datetime
+
+import cache
+import clock
+import constants
+import population
+import sinks
+import templates
+import util
+from resources import HostResources
+from writers import LogWriter
+from scheduler import Scheduler
+
+CONTENTION_FLOWS = 1000  # Concurrent flows in the host_contention stage
+
+# Keyword arguments each step used to pass to OAuthTransactionGenerator._audit_entry, alongside its template
+AUDIT_STEPS = [
+    (templates.AUTHN_START, dict(event=constants.Events.AUTHENTICATION_ATTEMPT, user="", protocol="",
+                                 role=constants.Roles.IDP, status=constants.Statuses.IN_PROGRESS)),
+    (templates.AUTHN_SUCCESS, dict(event=constants.Events.AUTHENTICATION_ATTEMPT, client="", protocol="",
+                                   role=constants.Roles.IDP)),
+    (templates.AUTHN_FAILURE, dict(event=constants.Events.AUTHENTICATION_ATTEMPT, client="", protocol="",
+                                   role=constants.Roles.IDP, status=constants.Statuses.IN_PROGRESS)),
+    (templates.AUTHZ_CODE_REQUEST, dict(grant_type=constants.GrantTypes.AUTH_CODE)),
+    (templates.AUTHZ_CODE_FAILURE, dict(grant_type=constants.GrantTypes.AUTH_CODE,
+                                        status=constants.Statuses.FAILURE,
+                                        description=constants.Errors.INVALID_SCOPE)),
+    (templates.AUTHZ_CODE_EXPIRY, dict(grant_type=constants.GrantTypes.AUTH_CODE, status=constants.Statuses.FAILURE,
+                                       description=constants.Errors.AUTHZ_CODE_EXPIRED)),
+    (templates.TOKEN_REQUEST, dict(grant_type=constants.GrantTypes.AUTH_CODE, adapter_id="")),
+    (templates.INTROSPECTION, dict(client=constants.Clients.RS_CLIENT, adapter_id="")),
+    (templates.INTROSPECTION_EXPIRY, dict(client=constants.Clients.RS_CLIENT, adapter_id="",
+                                          status=constants.Statuses.FAILURE,
+                                          description=constants.Errors.TOKEN_EXPIRED)),
+    (templates.VALIDATION, dict(client=constants.Clients.RS_CLIENT, grant_type=constants.GrantTypes.VALIDATE_BEARER,
+                                adapter_id="")),
+    (templates.VALIDATION_EXPIRY, dict(client=constants.Clients.RS_CLIENT,
+                                       grant_type=constants.GrantTypes.VALIDATE_BEARER, adapter_id="",
+                                       status=constants.Statuses.FAILURE,
+                                       description=constants.Errors.TOKEN_EXPIRED)),
+    (templates.REFRESH, dict(grant_type=constants.GrantTypes.REFRESH, adapter_id="")),
+    (templates.REFRESH_TOKEN_FAILURE, dict(grant_type=constants.GrantTypes.AUTH_CODE,
+                                           status=constants.Statuses.FAILURE, adapter_id="",
+                                           description=constants.Errors.INVALID_REFRESH_TOKEN))
+]
+
+
+class _Transaction:
+
+    def __init__(self):
+        self.tid = util.Mock.tid()
+        self.user = util.Mock.user()
+        self.ip = util.Mock.ip_address()
+        self.client = util.Mock.client()
+        self.host = util.Mock.host()
+        self.adapter_id = util.Mock.adapter()
+        self.event = constants.Events.OAUTH
+        self.role = constants.Roles.AS
+        self.protocol = constants.Protocols.OAUTH2
+        self.status = constants.Statuses.SUCCESS
+
+
+class _TimedScheduler(Scheduler):
+    """
+    Scheduler recording how long each flow step takes, for end-to-end latency.
+    """
+
+    def __init__(self, until=None):
+        Scheduler.__init__(self, until)
+        self.latencies = []
+
+    def _step(self, flow):
+        start = time.perf_counter()
+        Scheduler._step(self, flow)
+        self.latencies.append(time.perf_counter() - start)
+
+
+def legacy_audit_entry(
+        txn,
+        timestamp,
+        response_time,
+        role=None,
+        event=None,
+        user=None,
+        client=None,
+        protocol=None,
+        grant_type="",
+        status=None,
+        adapter_id=None,
+        description=""):
+    """
+    OAuthTransactionGenerator._audit_entry as it was before the step templates, kept as a baseline.
+    """
+    return "%s| tid:%s| %s| %s| %s| %s| %s| %s| %s| %s| %s| %s| %s| %s| %s\r\n" % (
+        timestamp,
+        txn.tid,
+        event if event is not None else txn.event,
+        user if user is not None else txn.user,
+        txn.ip,
+        "",
+        client if client is not None else txn.client,
+        protocol if protocol is not None else txn.protocol,
+        grant_type,
+        txn.host,
+        role if role is not None else txn.role,
+        status if status is not None else txn.status,
+        adapter_id if adapter_id is not None else txn.adapter_id,
+        description,
+        response_time
+    )
+
+
+def _report(lines, size, elapsed, latencies):
+    """
+    Throughput and per-line latency percentiles (in microseconds) of a stage.
+    """
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return latencies[min(int(len(latencies) * p / 100), len(latencies) - 1)] * 1e6 if latencies else None
+
+    return {
+        'lines': lines,
+        'bytes': size,
+        'seconds': elapsed,
+        'lines_per_sec': lines / elapsed,
+        'bytes_per_sec': size / elapsed,
+        'p50_us': percentile(50),
+        'p99_us': percentile(99)
+    }
+
+
+def _lines(n, line):
+    """
+    Time n calls of line(i), each returning the line (or other string) it produced.
+    """
+    perf_counter = time.perf_counter
+    latencies = []
+    size = 0
+    start = perf_counter()
+    for i in range(n):
+        t = perf_counter()
+        size += len(line(i))
+        latencies.append(perf_counter() - t)
+    return _report(n, size, perf_counter() - start, latencies)
+
+
+def mock_fields(n):
+    """
+    Generate the per-transaction util.Mock fields.
+    """
+    def line(i):
+        return '|'.join((util.Mock.tid(), util.Mock.user(), util.Mock.ip_address(), util.Mock.client(),
+                         util.Mock.host(), util.Mock.adapter(), str(util.Mock.response_time())))
+    return _lines(n, line)
+
+
+def population_fields(n):
+    """
+    Generate the per-transaction fields as transactions do, drawing users from a population of
+    Population.USERS (built before timing starts).
+    """
+    rng = random.Random()
+    users = population.Population(constants.Population.USERS, rng)
+
+    def line(i):
+        user, ip, client, adapter = users.draw(rng)
+        return '|'.join((util.Mock.tid(rng), user, ip, client, util.Mock.host(rng), adapter,
+                         str(util.Mock.response_time(rng))))
+    return _lines(n, line)
+
+
+def audit_formatting(n):
+    """
+    Format audit entries from the step templates. Timestamps and field values are fixed so only formatting
+    is measured.
+    """
+    txn = _Transaction()
+    timestamp = util.timestamp()
+    response_time = util.Mock.response_time()
+
+    for template, kwargs in AUDIT_STEPS:
+        expected = legacy_audit_entry(txn, timestamp, response_time, **kwargs)
+        actual = template(timestamp, txn.tid, txn.user, txn.ip, txn.client, txn.host, txn.adapter_id,
+                          response_time, kwargs.get('description', ""))
+        assert actual == expected, (actual, expected)
+
+    steps = [(template, kwargs.get('description', "")) for template, kwargs in AUDIT_STEPS]
+
+    def line(i):
+        template, description = steps[i % len(steps)]
+        return template(timestamp, txn.tid, txn.user, txn.ip, txn.client, txn.host, txn.adapter_id, response_time,
+                        description)
+    return _lines(n, line)
+
+
+def audit_formatting_legacy(n):
+    """
+    Format audit entries with the keyword-resolving formatter the templates replaced.
+    """
+    txn = _Transaction()
+    timestamp = util.timestamp()
+    response_time = util.Mock.response_time()
+
+    def line(i):
+        return legacy_audit_entry(txn, timestamp, response_time, **AUDIT_STEPS[i % len(AUDIT_STEPS)][1])
+    return _lines(n, line)
+
+
+def timestamps(n):
+    """
+    Format n times spread across a minute with the cached util.Timestamp.
+    """
+    start = time.time()
+    formatter = util.Timestamp()
+    return _lines(n, lambda i: formatter(start + i * 60 / n))
+
+
+def timestamps_strftime(n):
+    """
+    Format n times spread across a minute with a strftime per call.
+    """
+    start = time.time()
+    return _lines(n, lambda i: datetime.fromtimestamp(start + i * 60 / n).strftime('%Y-%m-%d %H:%M:%S,%f')[:-3])
+
+
+def timed_cache(n):
+    """
+    Add to a TimedCache and read back its entries, as host load sampling used to per transaction.
+    """
+    c = cache.TimedCache(constants.OAuth.TXN_CACHE_TTL)
+
+    def line(i):
+        c.add(1)
+        return '%d' % len(c.entries())
+    return _lines(n, line)
+
+
+def sliding_window_counter(n):
+    """
+    Add to a SlidingWindowCounter and read back its count, as host load sampling does per transaction.
+    """
+    c = cache.SlidingWindowCounter(constants.OAuth.TXN_CACHE_TTL, constants.OAuth.TXN_CACHE_RESOLUTION)
+    return _lines(n, lambda i: '%d' % c.add())
+
+
+def _timers(n, spawn):
+    """
+    Time n calls of spawn(delay, fn) for timers due over the next day of virtual time, then run the scheduler
+    until they have all fired. Latency is per spawn; the elapsed time includes firing.
+    """
+    import events
+
+    start = time.time()
+    clock.install(clock.VirtualClock(start))
+    scheduler = Scheduler(start + 3600 * 24 + constants.Timers.RESOLUTION)  # Wheel timers fire up to a tick late
+    events.bind(scheduler)
+    rng = random.Random(0)
+    fired = []
+    perf_counter = time.perf_counter
+    latencies = []
+    t0 = perf_counter()
+    for i in range(n):
+        delay = rng.random() * 3600 * 24
+        t = perf_counter()
+        spawn(scheduler, delay, fired.append)
+        latencies.append(perf_counter() - t)
+    scheduler.run()
+    elapsed = perf_counter() - t0
+    assert len(fired) == n, (len(fired), n)
+    return _report(n, 0, elapsed, latencies)
+
+
+def timer_wheel(n):
+    """
+    Spawn and fire n one-shot timers on the events timer wheel.
+    """
+    import events
+    return _timers(n, lambda scheduler, delay, fn: events.spawn_timer(delay, fn, None))
+
+
+def timer_heap(n):
+    """
+    Spawn and fire n one-shot timers as scheduler heap entries, for comparison with timer_wheel.
+    """
+    return _timers(n, lambda scheduler, delay, fn: scheduler.call_later(delay, fn, None))
+
+
+def host_contention(n):
+    """
+    Run n transactions from CONTENTION_FLOWS concurrent flows against the mock hosts' resource models while
+    another thread reads their recent transaction counts, as metrics scrapes do. Latency is per flow step,
+    i.e. per transaction.
+    """
+    start = time.time()
+    clock.install(clock.VirtualClock(start))
+    scheduler = _TimedScheduler(start + 3600 * 24 * 365)
+    hosts = [HostResources(h) for h in util.Mock.HOSTS]
+    remaining = [n]
+    done = threading.Event()
+    scrapes = [0]
+
+    def flow(rng):
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            rng.choice(hosts).transaction()
+            yield rng.random()
+
+    def scrape():
+        while not done.is_set():
+            sum(h.recent_transactions.peek() for h in hosts)
+            scrapes[0] += 1
+
+    for i in range(CONTENTION_FLOWS):
+        scheduler.spawn(flow(random.Random(i)))
+    reader = threading.Thread(target=scrape, daemon=True)
+    reader.start()
+    t = time.perf_counter()
+    scheduler.run()
+    elapsed = time.perf_counter() - t
+    done.set()
+    reader.join()
+    result = _report(n, 0, elapsed, scheduler.latencies)
+    result['scrapes'] = scrapes[0]
+    return result
+
+
+def flow_memory(n):
+    """
+    Hold n transaction flows suspended mid-transaction, as the scheduler does, and measure the memory each
+    takes: the flow object and its random stream, the suspended generators and the transaction's fields.
+    Latency is per flow created and started, timed without tracemalloc.
+    """
+    import generators
+    import tracemalloc
+
+    clock.install(clock.VirtualClock(time.time()))
+    generators.build_population()
+
+    def start_flows(latencies=None):
+        flows = [None] * n
+        for i in range(n):
+            t = time.perf_counter()
+            flow = generators.OAuthTransactionGenerator(register=False).run()
+            next(flow)  # Suspends at the first step's response time
+            flows[i] = flow
+            if latencies is not None:
+                latencies.append(time.perf_counter() - t)
+        return flows
+
+    latencies = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        t = time.perf_counter()
+        flows = start_flows(latencies)
+        elapsed = time.perf_counter() - t
+        del flows
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        flows = start_flows()  # Kept alive until the traced memory is read
+        size = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del flows
+    result = _report(n, 0, elapsed, latencies)
+    result['bytes_per_session'] = size / n
+    return result
+
+
+def log_writer(n, directory, spec='file'):
+    """
+    Queue n audit lines on a LogWriter; the elapsed time includes draining the queue to disk.
+
+    :param spec: File sink to write through, see sinks.from_spec.
+    """
+    txn = _Transaction()
+    line = templates.AUTHN_START(util.timestamp(), txn.tid, txn.user, txn.ip, txn.client, txn.host, txn.adapter_id,
+                                 util.Mock.response_time(), "")
+    path = os.path.join(directory, os.path.basename(constants.Logs.AUDIT_LOG))
+    flush_size, flush_interval = constants.Logs.FLUSH_POLICIES[constants.Logs.AUDIT_LOG]
+    writer = LogWriter(path, flush_size, flush_interval, sink=sinks.from_spec(spec, path))
+
+    perf_counter = time.perf_counter
+    latencies = []
+    start = perf_counter()
+    for i in range(n):
+        t = perf_counter()
+        writer.write(line)
+        latencies.append(perf_counter() - t)
+    writer.stop()
+    elapsed = perf_counter() - start
+    writer.join()
+    return _report(n, os.path.getsize(path), elapsed, latencies)
+
+
+def replay_logs(n, directory):
+    """
+    Replay a previously generated audit log of n lines, a millisecond apart, as fast as possible through a
+    LogWriter; the elapsed time includes draining the queue to disk. Latency is per scheduler step, i.e. per
+    batch of replayed lines.
+    """
+    import replay
+
+    source = os.path.join(directory, 'source')
+    os.makedirs(source)
+    txn = _Transaction()
+    start = time.time()
+    with open(os.path.join(source, os.path.basename(constants.Logs.AUDIT_LOG)), 'w') as f:
+        for i in range(n):
+            template, kwargs = AUDIT_STEPS[i % len(AUDIT_STEPS)]
+            f.write(template(util.timestamp(start + i / 1000), txn.tid, txn.user, txn.ip, txn.client, txn.host,
+                             txn.adapter_id, util.Mock.response_time(), kwargs.get('description', "")))
+
+    clock.install(clock.VirtualClock(start))
+    scheduler = _TimedScheduler(start + n)
+    path = os.path.join(directory, os.path.basename(constants.Logs.AUDIT_LOG))
+    flush_size, flush_interval = constants.Logs.FLUSH_POLICIES[constants.Logs.AUDIT_LOG]
+    writer = LogWriter(path, flush_size, flush_interval)
+
+    t = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        logs = replay.Replay(source, start)
+        for log in logs.logs():
+            scheduler.spawn(logs.flow(log, writer))
+        scheduler.run()
+    writer.stop()
+    elapsed = time.perf_counter() - t
+    writer.join()
+    return _report(n, os.path.getsize(path), elapsed, scheduler.latencies)
+
+
+def log_writer_prealloc(n, directory):
+    """
+    log_writer through a preallocated file written with pwritev.
+    """
+    return log_writer(n, directory, 'prealloc')
+
+
+def log_writer_mmap(n, directory):
+    """
+    log_writer through a memory-mapped preallocated file.
+    """
+    return log_writer(n, directory, 'mmap')
+
+
+def end_to_end(duration, directory):
+    """
+    Run the full generator in accelerated mode over duration virtual seconds, writing its logs to directory.
+    Latency is per scheduler step, i.e. per flow resumption, which writes at most one audit line (or one
+    line per log for OS metric flows).
+    """
+    import generators
+
+    start = time.time()
+    clock.install(clock.VirtualClock(start))
+    generators.SCHEDULER = _TimedScheduler(start + duration)
+    generators.LOG_DIR = directory
+    generators.build_population()  # Setup rather than generation, so not timed
+
+    t = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        generators.run()
+        generators.SCHEDULER.join()
+        generators.teardown()
+    elapsed = time.perf_counter() - t
+
+    lines = size = 0
+    for log in constants.Logs.ALL:
+        path = os.path.join(directory, os.path.basename(log))
+        with open(path, 'rb') as f:
+            lines += sum(1 for _ in f)
+        size += os.path.getsize(path)
+    return _report(lines, size, elapsed, generators.SCHEDULER.latencies)
+
+
+STAGES = [
+    ('mock_fields', mock_fields),
+    ('population_fields', population_fields),
+    ('audit_formatting', audit_formatting),
+    ('audit_formatting_legacy', audit_formatting_legacy),
+    ('timestamps', timestamps),
+    ('timestamps_strftime', timestamps_strftime),
+    ('timed_cache', timed_cache),
+    ('sliding_window_counter', sliding_window_counter),
+    ('timer_wheel', timer_wheel),
+    ('timer_heap', timer_heap),
+    ('host_contention', host_contention),
+    ('flow_memory', flow_memory),
+    ('log_writer', log_writer),
+    ('log_writer_prealloc', log_writer_prealloc),
+    ('log_writer_mmap', log_writer_mmap),
+    ('replay_logs', replay_logs),
+    ('end_to_end', end_to_end)
+]
+
+
+def _run_stage(fn, args, conn):
+    """
+    Stage process entry point: run the stage and send back its report with the process's peak RSS.
+    """
+    try:
+        result = fn(*args)
+        result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        conn.send(result)
+    except Exception as e:
+        conn.send({'error': repr(e)})
+    finally:
+        conn.close()
+
+
+def run_stage(name, fn, args):
+    """
+    Run a stage in a fresh process so its peak RSS and any module state it touches are its own.
+    """
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    p = context.Process(target=_run_stage, args=(fn, args, sender), name=name)
+    p.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {'error': 'stage exited with code %s' % p.exitcode}
+    p.join()
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Throughput benchmarks for the mock log generator pipeline')
+    parser.add_argument('-n', type=int, default=100000, help='lines per stage benchmark')
+    parser.add_argument('--duration', type=float, default=3600,
+                        help='virtual seconds of generation for the end_to_end stage')
+    parser.add_argument('--stages', nargs='+', choices=[name for name, fn in STAGES],
+                        help='stages to run, defaults to all')
+    parser.add_argument('--json', metavar='FILE', help='write results as JSON to FILE (- for stdout)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    directory = tempfile.mkdtemp(prefix='mock-log-benchmark-')
+    results = {
+        'time': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'n': args.n,
+        'duration': args.duration,
+        'stages': {}
+    }
+    try:
+        for name, fn in STAGES:
+            if args.stages and name not in args.stages:
+                continue
+            stage_directory = os.path.join(directory, name)
+            os.makedirs(stage_directory)
+            if fn is end_to_end:
+                stage_args = (args.duration, stage_directory)
+            elif fn in (log_writer, log_writer_prealloc, log_writer_mmap, replay_logs):
+                stage_args = (args.n, stage_directory)
+            else:
+                stage_args = (args.n,)
+            results['stages'][name] = result = run_stage(name, fn, stage_args)
+            if args.json != '-':
+                if 'error' in result:
+                    print('%-24s %s' % (name, result['error']))
+                else:
+                    print('%-24s %10.0f lines/s %12.0f bytes/s  p50 %8.2fus  p99 %8.2fus  peak rss %7d KB' % (
+                        name, result['lines_per_sec'], result['bytes_per_sec'], result['p50_us'], result['p99_us'],
+                        result['peak_rss_kb']))
+                if 'bytes_per_session' in result:
+                    print('%-24s %10.0f bytes/session' % ('', result['bytes_per_session']))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.json == '-':
+        print(json.dumps(results, indent=2, sort_keys=True))
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
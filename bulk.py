@@ -0,0 +1,337 @@
+import itertools
+import string
+from datetime import datetime
+
+import numpy as np
+
+import constants
+import rate
+import templates
+import util
+
+TID_ALPHABET = np.frombuffer((string.ascii_letters + string.digits + '-_').encode(), dtype=np.uint8)
+AUTHZ_CODE_FAILURE_DESCRIPTIONS = np.array(templates.AUTHZ_CODE_FAILURE_DESCRIPTIONS)
+
+DF_LINE = '%s\t\t%s\t\t%s\t\t%sG\t\t%sG\t\t%sG\t\t%s%%\t\t%s\r\n'
+CPU_LINE = '%s\t\t%s\t\t%s\t\t%.2f\t\t%.2f\t\t%.2f\t\t%.2f\t\t%.2f\r\n'
+MEM_LINE = '%s\t\t%s\t\t%s\t\t%s\t\t%s\t\t%.1f\t\t%.1f\t\t%s\t\t%s\t\t%.2f\r\n'
+
+
+class Backfill:
+    """
+    Synthesizes logs for a span of time in vectorized chunks instead of one record per call.
+
+    Flows run the OAuthTransactionGenerator state machine back to back, one numpy pass per
+    transaction for every flow due in the chunk, and every host reports df/cpu/mem rows each
+    OS metric interval, so the output has the same layout and shape as the live generators. The
+    number of running flows follows the daily usage curve like OAuthTransactionGenerator.usage_curve,
+    re-evaluated at the start of each chunk.
+    """
+
+    chunk = constants.OS_METRIC_GENERATION_INTERVAL  # Seconds synthesized per pass
+
+    def __init__(self, start, end, flows, hosts=None, rng=None):
+        """
+        :param start: Epoch time to start generating from.
+        :param end: Epoch time to stop at.
+        :param flows: Number of transaction flows outside of the usage curve, which adds up to
+                      Usage.PEAK_FLOWS more during the day.
+        :param hosts: Hosts to generate for. Defaults to util.Mock.HOSTS.
+        :param rng: numpy Generator to draw from. Defaults to a freshly seeded one.
+        """
+        self.start = start
+        self.end = end
+        self.hosts = np.array(hosts or util.Mock.HOSTS)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.users = np.array(['%s.%s@%s' % u for u in itertools.product(
+            util.Mock.FIRST_NAMES, util.Mock.LAST_NAMES, util.Mock.EMAIL_DOMAINS)])
+        self.clients = np.array(util.Mock.OAUTH_CLIENTS)
+        self.adapters = np.array(util.Mock.ADAPTERS)
+        self.networks = np.array([int(s.network_address) for s in util.Mock.SUBNETS], dtype=np.int64)
+        self.network_sizes = np.array([s.num_addresses for s in util.Mock.SUBNETS], dtype=np.int64)
+
+        self.base = flows
+        # Next transaction start of every flow the curve may run, inf for those not running
+        self._next_start = np.full(flows + constants.Usage.PEAK_FLOWS, np.inf)
+        self._running = 0
+        # Audit lines already synthesized for later chunks
+        self._pending_times = np.empty(0)
+        self._pending_lines = np.empty(0, dtype=object)
+        # Transaction end times and host indexes for the recent transaction window, sorted by time
+        self._ends = np.empty(0)
+        self._end_hosts = np.empty(0, dtype=np.int64)
+
+        h = len(self.hosts)
+        self._disk = self.rng.integers(constants.Disk.MIN_BASE_USAGE, constants.Disk.MAX_BASE_USAGE + 1, h) * 1.0
+        self._last_tick = start
+        self._next_cleanup = start + constants.DISK_CLEANUP_INTERVAL
+
+    def run(self, loggers):
+        """
+        Write everything from start to end to the LogWriters in loggers, keyed by constants.Logs path.
+        """
+        c0 = self.start
+        while c0 < self.end:
+            c1 = min(c0 + self.chunk, self.end)
+            self._write(loggers[constants.Logs.AUDIT_LOG], self.audit_lines(c0, c1))
+            df, cpu, mem = self.os_lines(c0, c1)
+            self._write(loggers[constants.Logs.DISK_USAGE_LOG], df)
+            self._write(loggers[constants.Logs.CPU_USAGE_LOG], cpu)
+            self._write(loggers[constants.Logs.MEMORY_USAGE_LOG], mem)
+            c0 = c1
+
+    def audit_lines(self, c0, c1):
+        """
+        Run every flow due before c1 and return the audit lines timestamped in [c0, c1), in order.
+        """
+        self._follow_curve(c0)
+        times = [self._pending_times]
+        lines = [self._pending_lines]
+        ends = [self._ends]
+        end_hosts = [self._end_hosts]
+        while True:
+            due = np.flatnonzero(self._next_start < c1)
+            if not len(due):
+                break
+            t = self._next_start[due]
+            groups = []
+            self._transaction(t, groups)
+            fields = self._scramble(len(due))
+            for group_times, template, idx, response_times, descriptions in groups:
+                times.append(group_times)
+                lines.append(self._format(template, group_times, idx, response_times, descriptions, fields))
+            ends.append(t)
+            end_hosts.append(fields[4])
+            self._next_start[due] = t + self.rng.integers(1, 4, len(due))
+
+        times = np.concatenate(times)
+        lines = np.concatenate(lines)
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        lines = lines[order]
+        split = np.searchsorted(times, c1)
+        self._pending_times = times[split:]
+        self._pending_lines = lines[split:]
+
+        ends = np.concatenate(ends)
+        end_hosts = np.concatenate(end_hosts)
+        order = np.argsort(ends, kind='stable')
+        self._ends = ends[order]
+        self._end_hosts = end_hosts[order]
+        return lines[:split].tolist()
+
+    def os_lines(self, c0, c1):
+        """
+        Return the (df, cpu, mem) lines for every OS metric tick in [c0, c1).
+
+        Must be called after audit_lines for the same chunk so the transactions it counts are known.
+        """
+        interval = constants.OS_METRIC_GENERATION_INTERVAL
+        first = self.start + -(-(c0 - self.start) // interval) * interval
+        df, cpu, mem = [], [], []
+        for tick in np.arange(first, c1, interval):
+            self._update_disk(tick)
+            recent = self._recent_counts(tick)
+            timestamps = self._timestamps(np.full(len(self.hosts), tick))
+            df.extend(self._df_lines(timestamps))
+            cpu.extend(self._cpu_lines(timestamps, recent))
+            mem.extend(self._mem_lines(timestamps, recent))
+        # Drop transactions which have aged out of every future tick's window
+        keep = np.searchsorted(self._ends, c1 - constants.OAuth.TXN_CACHE_TTL)
+        self._ends = self._ends[keep:]
+        self._end_hosts = self._end_hosts[keep:]
+        return df, cpu, mem
+
+    def _follow_curve(self, t):
+        """
+        Start or stop flows so as many are running at t as the usage curve expects.
+        """
+        target = self.base + round(constants.Usage.PEAK_FLOWS * rate.usage_level(t))
+        if target > self._running:
+            # Flows are staggered on start like LogGenerator.spawn_flows
+            self._next_start[self._running:target] = (
+                t + self.rng.random(target - self._running) * constants.Usage.CURVE_INTERVAL)
+        else:
+            self._next_start[target:self._running] = np.inf
+        self._running = target
+
+    def _transaction(self, t, groups):
+        """
+        Advance t, the start times of a batch of flows, through one transaction each, appending a
+        (times, template, flow indexes, response times, descriptions) group for every line written.
+        """
+        rng = self.rng
+
+        def write(template, idx, descriptions=None):
+            response_times = self._response_times(len(idx))
+            t[idx] += response_times / 1000
+            groups.append((t[idx], template, idx, response_times, descriptions))
+
+        def branch(idx, p):
+            hit = rng.random(len(idx)) > p
+            return idx[hit], idx[~hit]
+
+        idx = np.arange(len(t))
+        write(templates.AUTHN_START, idx)
+        t[idx] += rng.integers(constants.OAuth.MIN_AUTHN_TIME, constants.OAuth.MAX_AUTHN_TIME + 1, len(idx))
+        failed, idx = branch(idx, .90)
+        write(templates.AUTHN_FAILURE, failed)
+        write(templates.AUTHN_SUCCESS, idx)
+        failed, idx = branch(idx, .90)
+        write(templates.AUTHZ_CODE_FAILURE, failed,
+              AUTHZ_CODE_FAILURE_DESCRIPTIONS[rng.integers(0, len(AUTHZ_CODE_FAILURE_DESCRIPTIONS), len(failed))])
+        expired, idx = branch(idx, .92)
+        t[expired] += constants.OAuth.AUTH_CODE_LIFETIME
+        write(templates.AUTHZ_CODE_EXPIRY, expired)
+        write(templates.AUTHZ_CODE_REQUEST, idx)
+        write(templates.TOKEN_REQUEST, idx)
+        expired, idx = branch(idx, .97)
+        t[expired] += constants.OAuth.ACCESS_TOKEN_LIFETIME
+        write(templates.INTROSPECTION_EXPIRY, expired)
+        write(templates.INTROSPECTION, idx)
+        expired, idx = branch(idx, .97)
+        t[expired] += constants.OAuth.ACCESS_TOKEN_LIFETIME
+        write(templates.VALIDATION_EXPIRY, expired)
+        write(templates.VALIDATION, idx)
+        t[idx] += rng.integers(constants.OAuth.MIN_REFRESH_TIME, constants.OAuth.MAX_REFRESH_TIME + 1, len(idx))
+        expired, idx = branch(idx, .98)
+        t[expired] += constants.OAuth.REFRESH_TOKEN_LIFETIME
+        write(templates.REFRESH_TOKEN_FAILURE, expired)
+        write(templates.REFRESH, idx)
+
+    def _scramble(self, n):
+        """
+        Draw the per-transaction fields for n transactions: (tids, users, ips, clients, host indexes, adapters)
+        """
+        rng = self.rng
+        tids = TID_ALPHABET[rng.integers(0, len(TID_ALPHABET), (n, 27))].view('S27').ravel().astype('U27')
+        subnets = rng.integers(0, len(self.networks), n)
+        addresses = self.networks[subnets] + rng.integers(0, self.network_sizes[subnets])
+        octets = (addresses[:, None] >> np.array([24, 16, 8, 0])) & 255
+        ips = np.array(['%d.%d.%d.%d' % tuple(o) for o in octets.tolist()])
+        return (
+            tids,
+            self.users[rng.integers(0, len(self.users), n)],
+            ips,
+            self.clients[rng.integers(0, len(self.clients), n)],
+            rng.integers(0, len(self.hosts), n),
+            self.adapters[rng.integers(0, len(self.adapters), n)]
+        )
+
+    def _format(self, template, times, idx, response_times, descriptions, fields):
+        tids, users, ips, clients, hosts, adapters = fields
+        lines = np.empty(len(idx), dtype=object)
+        lines[:] = list(map(
+            template,
+            self._timestamps(times),
+            tids[idx].tolist(),
+            users[idx].tolist(),
+            ips[idx].tolist(),
+            clients[idx].tolist(),
+            self.hosts[hosts[idx]].tolist(),
+            adapters[idx].tolist(),
+            response_times.tolist(),
+            descriptions.tolist() if descriptions is not None else itertools.repeat('')
+        ))
+        return lines
+
+    def _response_times(self, n):
+        # Same distribution as util.Mock.response_time
+        return np.where(self.rng.random(n) < 0.95,
+                        self.rng.integers(5, 101, n),
+                        self.rng.integers(1000, 5001, n))
+
+    def _update_disk(self, tick):
+        """
+        Apply transaction disk usage and any 2-hourly cleanups up to tick, in time order.
+        """
+        while self._next_cleanup <= tick:
+            self._add_disk_usage(self._last_tick, self._next_cleanup)
+            self._disk = self.rng.integers(constants.Disk.MIN_BASE_USAGE, constants.Disk.MAX_BASE_USAGE + 1,
+                                           len(self.hosts)) * 1.0
+            self._last_tick = self._next_cleanup
+            self._next_cleanup += constants.DISK_CLEANUP_INTERVAL
+        self._add_disk_usage(self._last_tick, tick)
+        self._last_tick = tick
+
+    def _add_disk_usage(self, t0, t1):
+        lo, hi = np.searchsorted(self._ends, [t0, t1], side='right')
+        counts = np.bincount(self._end_hosts[lo:hi], minlength=len(self.hosts))
+        self._disk = np.minimum(self._disk + counts * constants.Disk.USAGE_INCREMENT_PER_TRANSACTION, 100)
+
+    def _recent_counts(self, tick):
+        lo, hi = np.searchsorted(self._ends, [tick - constants.OAuth.TXN_CACHE_TTL, tick], side='right')
+        return np.bincount(self._end_hosts[lo:hi], minlength=len(self.hosts))
+
+    def _sum_uniform(self, counts, scale):
+        """
+        Sample the sum of counts[i] uniform(0, scale) draws for each i using its normal approximation.
+        """
+        total = self.rng.normal(counts / 2, np.sqrt(counts / 12)) * scale
+        return np.clip(total, 0, counts * scale)
+
+    def _df_lines(self, timestamps):
+        size = constants.Disk.DISK_SIZE_DEFAULT
+        usage_percentage = np.ceil(self._disk).astype(np.int64)
+        used = usage_percentage * size // 100
+        return [DF_LINE % (ts, host, constants.Disk.FILESYSTEM_DEFAULT, size, u, size - u, p,
+                           constants.Disk.MOUNT_PATH_DEFAULT)
+                for ts, host, u, p in zip(timestamps, self.hosts.tolist(), used.tolist(), usage_percentage.tolist())]
+
+    def _cpu_lines(self, timestamps, recent):
+        rng = self.rng
+        h = len(self.hosts)
+        usr = (rng.integers(constants.Cpu.MIN_BASE_USAGE, constants.Cpu.MAX_BASE_USAGE + 1, h)
+               + self._sum_uniform(recent, constants.Cpu.MAX_USAGE_PER_TRANSACTION))
+        nice = rng.random(h) * constants.Cpu.NICE_MAX
+        system = rng.random(h) * constants.Cpu.SYS_MAX
+        wait = rng.random(h) * constants.Cpu.WAIT_MAX
+        usr = np.minimum(usr, 100 - (nice + system + wait))  # Bounded like OSLogGenerator._cpu_entry
+        idle = np.maximum(100 - (usr + nice + system + wait), 0)
+        return [CPU_LINE % ((ts, host, constants.Cpu.ALL) + tuple(row))
+                for ts, host, row in zip(timestamps, self.hosts.tolist(),
+                                         np.stack([usr, nice, system, wait, idle], axis=1).tolist())]
+
+    def _mem_lines(self, timestamps, recent):
+        rng = self.rng
+        h = len(self.hosts)
+        mem_total = constants.Memory.DEFAULT_TOTAL
+        per_transaction = constants.Memory.MAX_USAGE_PER_TRANSACTION
+        # Each transaction adds ceil(uniform(0, 100)), i.e. uniform over 1..100
+        mem = rng.normal(recent * (per_transaction + 1) / 2, np.sqrt(recent * (per_transaction ** 2 - 1) / 12))
+        mem_used = (rng.integers(constants.Memory.MIN_BASE_USAGE, constants.Memory.MAX_BASE_USAGE + 1, h)
+                    + np.clip(np.rint(mem), recent, recent * per_transaction).astype(np.int64))
+        # Saturate below the cap like HostResources.transaction
+        cap = mem_total * constants.Memory.MAX_USED
+        saturated = np.rint(mem_total * (constants.Memory.MAX_USED
+                                         - rng.random(h) * constants.Memory.SATURATION_SPREAD)).astype(np.int64)
+        mem_used = np.where(mem_used > cap, saturated, mem_used)
+        mem_free = mem_total - mem_used
+        free_percentage = mem_free / mem_total * 100
+        processes = rng.integers(constants.Memory.MIN_PROCESSES, constants.Memory.MAX_PROCESSES + 1, h) + recent
+        threads = rng.integers(constants.Memory.MIN_THREADS, constants.Memory.MAX_THREADS + 1, h) + recent * 2
+        interrupts = rng.integers(constants.Memory.MIN_INTERRUPTS, constants.Memory.MAX_INTERRUPTS + 1, h)
+        return [MEM_LINE % (ts, host, mem_total, f, u, fp, 100 - fp, p, t, i)
+                for ts, host, f, u, fp, p, t, i in zip(
+                    timestamps, self.hosts.tolist(), mem_free.tolist(), mem_used.tolist(),
+                    free_percentage.tolist(), processes.tolist(), threads.tolist(), interrupts.tolist())]
+
+    @staticmethod
+    def _timestamps(times):
+        """
+        Format epoch times like util.timestamp, running strftime once per distinct second.
+        """
+        seconds = np.floor(times)
+        us = np.round((times - seconds) * 1000000)
+        carry = us >= 1000000
+        seconds += carry
+        us[carry] -= 1000000
+        unique, inverse = np.unique(seconds, return_inverse=True)
+        prefixes = [datetime.fromtimestamp(s).strftime('%Y-%m-%d %H:%M:%S,') for s in unique.tolist()]
+        millis = util.Timestamp.MILLIS
+        return [prefixes[i] + millis[ms] for i, ms in zip(inverse.tolist(), (us // 1000).astype(np.int64).tolist())]
+
+    @staticmethod
+    def _write(logger, lines):
+        if lines:
+            logger.write(''.join(lines), len(lines))
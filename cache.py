@@ -1,7 +1,9 @@
-import time
 import itertools
+import math
 import threading
 
+import clock
+
 
 class TimedCache:
     """
@@ -12,11 +14,11 @@ class TimedCache:
 
         def __init__(self, value, ttl):
             self.value = value
-            self.expires_at = time.time() + ttl
+            self.expires_at = clock.now() + ttl
             self._expired = False
 
         def is_expired(self):
-            return self._expired or self.expires_at < time.time()
+            return self._expired or self.expires_at < clock.now()
 
     def __init__(self, ttl=30):
         self._entries = []
@@ -31,3 +33,65 @@ class TimedCache:
         with self.lock:
             self._entries = list(itertools.dropwhile(lambda x: x.is_expired(), self._entries))
             return self._entries
+
+
+class SlidingWindowCounter:
+    """
+    Count of events in the last window seconds, used for recent transaction counts on mock hosts
+
+    Events are tallied in a ring of buckets covering resolution seconds each, so adding and counting are
+    O(1) (amortized) and memory is fixed however high the event rate. Events age out a bucket at a time,
+    so the count is exact to within one resolution step.
+
+    The counter is not locked: add() and count() must only be called from the thread which owns it (the
+    scheduler thread, for hosts), while other threads read it with peek().
+    """
+
+    def __init__(self, window=30, resolution=1):
+        self.window = window
+        self.resolution = resolution
+        self._buckets = [0] * max(1, math.ceil(window / resolution))
+        self._total = 0
+        self._newest = self._bucket()
+
+    def add(self, n=1):
+        """
+        Record n events now.
+
+        :return: The count including the new events.
+        """
+        self._advance()
+        self._buckets[self._newest % len(self._buckets)] += n
+        self._total += n
+        return self._total
+
+    def count(self):
+        self._advance()
+        return self._total
+
+    def peek(self):
+        """
+        Count as of now without updating the counter, so safe to call from any thread. The owner may be
+        adding at the same time, in which case the count is off by at most the events being added.
+        """
+        newest, total = self._newest, self._total
+        now = self._bucket()
+        if now - newest >= len(self._buckets):
+            return 0
+        for b in range(newest + 1, now + 1):
+            total -= self._buckets[b % len(self._buckets)]
+        return max(total, 0)
+
+    def _bucket(self):
+        return math.floor(clock.now() / self.resolution)
+
+    def _advance(self):
+        """
+        Clear the buckets which have slid out of the window since the last call.
+        """
+        now = self._bucket()
+        for b in range(self._newest + 1, min(now, self._newest + len(self._buckets)) + 1):
+            slot = b % len(self._buckets)
+            self._total -= self._buckets[slot]
+            self._buckets[slot] = 0
+        self._newest = max(now, self._newest)
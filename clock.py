@@ -0,0 +1,55 @@
+import time
+
+CLOCK = None
+
+
+class WallClock:
+    """
+    Real time; waiting blocks for the remaining wall-clock time.
+    """
+
+    def time(self):
+        return time.time()
+
+    def wait(self, condition, due):
+        """
+        Block on condition until due (in clock seconds) or until it is notified.
+        """
+        condition.wait(due - self.time())
+
+
+class VirtualClock:
+    """
+    Simulated time starting at a given epoch timestamp.
+
+    With a speed of 0 the clock only moves when the scheduler jumps it to the next pending event, so
+    generation runs as fast as the CPU allows; otherwise it runs at speed times real time.
+    """
+
+    def __init__(self, start, speed=0):
+        self.speed = speed
+        self._now = start
+        self._real_start = time.monotonic()
+
+    def time(self):
+        if self.speed:
+            return self._now + (time.monotonic() - self._real_start) * self.speed
+        return self._now
+
+    def wait(self, condition, due):
+        if self.speed:
+            condition.wait((due - self.time()) / self.speed)
+        else:
+            self._now = max(self._now, due)
+
+
+def now():
+    return CLOCK.time()
+
+
+def install(c):
+    global CLOCK
+    CLOCK = c
+
+
+install(WallClock())
@@ -1,4 +1,6 @@
 OS_METRIC_GENERATION_INTERVAL = 60
+OS_METRIC_TICK = 1  # Seconds between steps of the OS metric flow, a divisor of OS_METRIC_GENERATION_INTERVAL
+DISK_CLEANUP_INTERVAL = 3600 * 2
 BASE_LOG_DIR = '/var/log/mock/'
 
 
@@ -6,6 +8,7 @@ class OAuth:
     TXN_MIN_THREADS = 15
     TXN_MAX_THREADS = 20
     TXN_CACHE_TTL = 300
+    TXN_CACHE_RESOLUTION = 1  # Seconds covered by each bucket of the recent transaction counters
     MIN_AUTHN_TIME = 5
     MAX_AUTHN_TIME = 10
     MIN_REFRESH_TIME = 10
@@ -15,12 +18,50 @@ class OAuth:
     REFRESH_TOKEN_LIFETIME = 120
 
 
+class Overflow:
+    BLOCK = 'block'  # Wait for the writer to make room
+    DROP_OLDEST = 'drop-oldest'
+    DROP_NEWEST = 'drop-newest'
+    SPILL = 'spill'  # Queue records in a file next to the log until the writer catches up
+
+
 # TODO: ps and network logs (what do we need from these?)
 class Logs:
     AUDIT_LOG = BASE_LOG_DIR + 'audit.log'
     CPU_USAGE_LOG = BASE_LOG_DIR + 'cpu.log'
     DISK_USAGE_LOG = BASE_LOG_DIR + 'df.log'
     MEMORY_USAGE_LOG = BASE_LOG_DIR + 'mem.log'
+    ALL = (AUDIT_LOG, CPU_USAGE_LOG, DISK_USAGE_LOG, MEMORY_USAGE_LOG)
+    # Writers flush once (bytes, seconds) worth of records are buffered, whichever comes first
+    FLUSH_POLICIES = {
+        AUDIT_LOG: (64 * 1024, 0.2),
+        CPU_USAGE_LOG: (16 * 1024, 1),
+        DISK_USAGE_LOG: (16 * 1024, 1),
+        MEMORY_USAGE_LOG: (16 * 1024, 1)
+    }
+    # Writers queue at most n records (0 for no limit) and apply the Overflow policy once full
+    QUEUE_POLICIES = {
+        AUDIT_LOG: (100000, Overflow.BLOCK),
+        CPU_USAGE_LOG: (10000, Overflow.DROP_OLDEST),  # A fresh sample is worth more than a stale one
+        DISK_USAGE_LOG: (10000, Overflow.DROP_OLDEST),
+        MEMORY_USAGE_LOG: (10000, Overflow.DROP_OLDEST)
+    }
+    # Rotate file logs once they reach max bytes or their records reach each 'hourly'/'daily' boundary (None for
+    # size only), keeping n generations, from the second on gzipped if compress is set (see sinks.FileSink)
+    ROTATION_POLICIES = {
+        AUDIT_LOG: (100 * 1024 ** 2, 'daily', 7, True),
+        CPU_USAGE_LOG: (100 * 1024 ** 2, 'daily', 7, True),
+        DISK_USAGE_LOG: (100 * 1024 ** 2, 'daily', 7, True),
+        MEMORY_USAGE_LOG: (100 * 1024 ** 2, 'daily', 7, True)
+    }
+    # Where each log is written, see sinks.from_spec: file, gzip, zstd, prealloc, mmap, stdout, udp://host:port,
+    # tcp://host:port (RFC 5424 syslog), unix:///path or unixgram:///path
+    SINKS = {
+        AUDIT_LOG: 'file',
+        CPU_USAGE_LOG: 'file',
+        DISK_USAGE_LOG: 'file',
+        MEMORY_USAGE_LOG: 'file'
+    }
 
 
 class Events:
@@ -66,8 +107,43 @@ class Usage:
     KICKOFF_TIME = 6  # Kick off the usage curve hike at 6am
     PEAK_TIME = 11  # Peak at 11am
     DROPOFF_TIME = 20  # Drop off usage at 8pm
-    INCREASE_INTERVAL = 5  # Increase usage every 5 minutes
-    INCREASE_VOLUME = 5  # Number of threads to spawn every interval
+    PEAK_FLOWS = 300  # Transaction flows added on top of the base load at peak
+    CURVE_INTERVAL = 5  # Seconds between re-evaluating the usage curve
+
+
+class Rate:
+    BASE_EPS = 20  # Audit events per second outside of the usage curve
+    TICK = 1  # Seconds between rate controller steps
+    REPORT_INTERVAL = 60  # Seconds between achieved vs. target rate reports
+    EVENTS_PER_TRANSACTION = 6  # Starting estimate, refined from the transactions that complete
+    MAX_WRITER_BACKLOG = 100000  # Queued audit records beyond which an unbounded writer is considered behind
+
+
+class Population:
+    USERS = 100000  # Users transactions are drawn from, see population.Population
+    USER_SKEW = 1.0  # Zipf exponent of user popularity
+    CLIENT_SKEW = 1.2  # Zipf exponent of OAuth client popularity, in util.Mock.OAUTH_CLIENTS order
+    PREFERRED_CLIENT = 0.9  # Chance a transaction uses the user's preferred client rather than any client
+    HOT_USERS = 10000  # Most popular users whose fields are formatted up front
+
+
+class Metrics:
+    PORT = 9464  # Default port for --metrics; shard workers serve on the ports after it
+    DUMP_INTERVAL = 15  # Seconds between rewrites of --metrics-file
+    RATE_WINDOW = 5  # Minimum seconds between the counter readings lines/bytes per second are measured over
+    WRITE_SAMPLE = 64  # Time one in this many LogWriter.write() calls
+    # Upper bounds of the write and flush latency histogram buckets, in seconds
+    LATENCY_BUCKETS = (0.000001, 0.000005, 0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1,
+                       0.5, 1)
+
+
+class Replay:
+    BATCH_INTERVAL = 1  # Seconds between batches of replayed lines, so how late a replayed line may be written
+    MAX_BATCH = 10000  # Lines replayed per batch at most, however dense the log
+
+
+class Timers:
+    RESOLUTION = 1  # Seconds per tick of the events timer wheel; timers fire up to a tick late
 
 
 class Cpu:
@@ -94,6 +170,8 @@ class Memory:
     MAX_INTERRUPTS = 750
     MAX_USAGE_PER_TRANSACTION = 100
     DEFAULT_TOTAL = 32 * 1024  # 32GB in MB
+    MAX_USED = 0.95  # Share of DEFAULT_TOTAL used memory saturates at, leaving the rest free
+    SATURATION_SPREAD = 0.05  # Share of DEFAULT_TOTAL saturated usage wobbles over below MAX_USED
 
 
 class Disk:
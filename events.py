@@ -1,20 +1,225 @@
-import threading
+import math
 
-TIMERS = []
+import clock
+import constants
+
+WHEEL = None
+SCHEDULER = None
+_WAKEUP = None  # (clock time, scheduler entry) of the scheduler call which next advances the wheel
+
+
+class Timer:
+    """
+    Handle for a pending timer, returned by spawn_timer and spawn_recurring.
+    """
+
+    __slots__ = ('due', 'fn', 'args', 'kwargs', 'interval', 'wheel')
+
+    def __init__(self, due, fn, args, kwargs, interval=None):
+        self.due = due
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.interval = interval
+        self.wheel = None
+
+    def cancel(self):
+        """
+        Stop the timer, including any recurrences. Cancelled timers are dropped when their slot comes up.
+        """
+        if self.fn is not None and self.wheel is not None:
+            self.wheel.pending -= 1
+        self.fn = self.wheel = None
+
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel holding timers until they come due.
+
+    Time is divided into ticks of resolution seconds. Level 0 has a slot for each of the next SLOTS
+    ticks, and each level above covers SLOTS times the span of the one below, one slot per span of the
+    level below. Adding a timer appends it to the slot for its due tick, in O(1). As time advances each
+    level 0 slot is fired in turn, and whenever level 0 wraps around the next slot of the level above is
+    cascaded down, its timers re-added closer to their due time. Timers further out than the top level
+    wait in its furthest slot and are re-added each time it cascades.
+    """
+
+    BITS = 6
+    SLOTS = 1 << BITS
+    LEVELS = 4
+
+    def __init__(self, now, resolution=constants.Timers.RESOLUTION):
+        self.resolution = resolution
+        self.pending = 0  # Timers added and neither fired nor cancelled
+        self._tick = math.floor(now / resolution)  # Next tick to fire
+        self._levels = [[[] for n in range(self.SLOTS)] for level in range(self.LEVELS)]
+        self._counts = [0] * self.LEVELS  # Timers in each level, including cancelled ones not yet dropped
+
+    def add(self, timer):
+        timer.wheel = self
+        self.pending += 1
+        self._add(timer)
+
+    def advance(self, now):
+        """
+        Move the wheel on to now.
+
+        :return: Timers which came due, in due order to within a tick. Recurring timers are re-added for
+                 their next due time.
+        """
+        target = math.floor(now / self.resolution)
+        due = []
+        while self._tick <= target:
+            index = self._tick & (self.SLOTS - 1)
+            if index == 0:
+                self._cascade()
+            elif not self._counts[0]:
+                # Nothing in level 0, so skip to where the next cascade may put something there
+                self._tick = min(self._tick - index + self.SLOTS, target + 1)
+                continue
+            slot = self._levels[0][index]
+            if slot:
+                self._counts[0] -= len(slot)
+                due.extend(t for t in slot if t.fn is not None)
+                self._levels[0][index] = []
+            self._tick += 1
+        for timer in due:
+            if timer.interval:
+                timer.due += timer.interval
+                self._add(timer)
+            else:
+                timer.wheel = None  # Out of the wheel, cancelling it now only stops it running
+                self.pending -= 1
+        return due
+
+    def next_due(self):
+        """
+        Clock time by which advance() may next have something to do, or None if the wheel is empty.
+        """
+        if not self.pending:
+            return None
+        ticks = []
+        for level in range(self.LEVELS):
+            if not self._counts[level]:
+                continue
+            shift = level * self.BITS
+            base = self._tick >> shift
+            # A slot fires or cascades at the start of its span, so unless the next tick starts the
+            # span of this level's current slot, that slot has already cascaded and comes round last
+            first = 1 if self._tick & ((1 << shift) - 1) else 0
+            for n in range(first, first + self.SLOTS):
+                if self._levels[level][(base + n) & (self.SLOTS - 1)]:
+                    ticks.append((base + n) << shift)
+                    break
+        return min(ticks) * self.resolution if ticks else None
+
+    def clear(self):
+        for level in self._levels:
+            for slot in level:
+                for timer in slot:
+                    timer.fn = timer.wheel = None
+                del slot[:]
+        self._counts = [0] * self.LEVELS
+        self.pending = 0
+
+    def _add(self, timer):
+        tick = max(math.ceil(timer.due / self.resolution), self._tick)
+        delta = tick - self._tick
+        level = 0
+        while delta >= 1 << ((level + 1) * self.BITS) and level < self.LEVELS - 1:
+            level += 1
+        if delta >= 1 << (self.LEVELS * self.BITS):
+            tick = self._tick + (1 << (self.LEVELS * self.BITS)) - 1  # Park it in the furthest slot
+        self._levels[level][(tick >> (level * self.BITS)) & (self.SLOTS - 1)].append(timer)
+        self._counts[level] += 1
+
+    def _cascade(self):
+        """
+        Re-add the timers of the next slot of each level above whose lower level has wrapped around.
+        """
+        for level in range(1, self.LEVELS):
+            index = (self._tick >> (level * self.BITS)) & (self.SLOTS - 1)
+            slot = self._levels[level][index]
+            if slot:
+                self._counts[level] -= len(slot)
+                self._levels[level][index] = []
+                for timer in slot:
+                    if timer.fn is not None:
+                        self._add(timer)
+            if index:
+                break  # The levels above only move when this one wraps too
+
+
+def bind(scheduler):
+    """
+    Run timers on the given scheduler so they follow the same (possibly virtual) clock as the flows.
+    """
+    global SCHEDULER, WHEEL, _WAKEUP
+    SCHEDULER = scheduler
+    WHEEL = TimerWheel(clock.now())
+    _WAKEUP = None
 
 
 def spawn_timer(i, fn, *args, **kwargs):
-    t = threading.Timer(i, fn, args=args, kwargs=kwargs)
-    TIMERS.append(t)
-    t.start()
+    """
+    Run fn(*args, **kwargs) on the scheduler after i seconds.
+
+    :return: Timer handle, which can be cancelled.
+    """
+    return _spawn(Timer(clock.now() + i, fn, args, kwargs))
+
+
+def spawn_recurring(interval, fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) on the scheduler every interval seconds, starting interval seconds from now.
+
+    :return: Timer handle, which can be cancelled.
+    """
+    return _spawn(Timer(clock.now() + interval, fn, args, kwargs, interval))
 
 
 def kill_timers():
-    # FIXME: is it possible that this might cause issues if a timer function is currently running?
-    for t in TIMERS:
-        t.cancel()
+    """
+    Drop every pending timer. Only call this from the scheduler thread or once the scheduler has stopped.
+    """
+    global _WAKEUP
+    if WHEEL is None:
+        return
+    WHEEL.clear()
+    if _WAKEUP is not None:
+        SCHEDULER.cancel(_WAKEUP[1])
+        _WAKEUP = None
+
+
+def _spawn(timer):
+    WHEEL.add(timer)
+    _wake_by(math.ceil(timer.due / WHEEL.resolution) * WHEEL.resolution)  # When its tick fires
+    return timer
+
+
+def _wake_by(t):
+    """
+    Have the scheduler advance the wheel at t, unless it will already do so by then.
+    """
+    global _WAKEUP
+    if _WAKEUP is not None:
+        if _WAKEUP[0] <= t:
+            return
+        SCHEDULER.cancel(_WAKEUP[1])
+    _WAKEUP = (t, SCHEDULER.call_later(max(t - clock.now(), 0), _fire))
 
-    for t in TIMERS:
-        t.join()
 
-    TIMERS.clear()
+def _fire():
+    global _WAKEUP
+    _WAKEUP = None
+    for timer in WHEEL.advance(clock.now()):
+        fn = timer.fn
+        if fn is None:
+            continue  # Cancelled by an earlier timer in the batch
+        try:
+            fn(*timer.args, **timer.kwargs)
+        except Exception as e:
+            print(e)
+    t = WHEEL.next_due()
+    if t is not None:
+        _wake_by(t)
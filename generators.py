@@ -1,104 +1,145 @@
 #!/usr/bin/python3.5 -p
 
+import argparse
+import functools
 import time
-import threading
 import uuid
 import math
+import os
 import signal
 import sys
-from random import random, randint, choice
-from functools import reduce
+from datetime import datetime
+from random import Random
 
 import util
+import clock
 import constants
 import events
-from cache import TimedCache
-from logging import LogWriter
-
-# Create a timed cache for each host to track recent transactions
-RECENT_TRANSACTION_CACHE_BY_HOST = {h: TimedCache(constants.OAuth.TXN_CACHE_TTL) for h in util.Mock.HOSTS}
-
-CPU_USAGE_BY_HOST = {h: randint(constants.Cpu.MIN_BASE_USAGE, constants.Cpu.MAX_BASE_USAGE) for h in util.Mock.HOSTS}
-MEMORY_USAGE_BY_HOST = {h: randint(constants.Memory.MIN_BASE_USAGE, constants.Memory.MAX_BASE_USAGE) for h in util.Mock.HOSTS}
-DISK_USAGE_BY_HOST = {h: randint(constants.Disk.MIN_BASE_USAGE, constants.Disk.MAX_BASE_USAGE) for h in util.Mock.HOSTS}
+import metrics
+import population
+import rate
+import shards
+import sinks
+import templates
+from resources import HostResources
+from writers import AsyncLogWriter, LogWriter
+from scheduler import AsyncioScheduler, Scheduler
+
+RESOURCES_BY_HOST = {h: HostResources(h) for h in util.Mock.HOSTS}
+RNG = util.rng('coordinator')  # This process's random stream for scheduling decisions; flows draw their own
 
 LOGGERS = {}
-OS_METRIC_THREADS = {}
-# XXX: should this be individual to each class?
-LOCK = threading.Lock()
+SCHEDULER = Scheduler()
+COORDINATOR = None
+LOG_DIR = None  # Directory to write logs to instead of constants.BASE_LOG_DIR
+RATE = None  # (eps, peak_eps) to pace transactions to a target event rate instead of running flows
+RATE_CONTROLLER = None
+METRICS_PORT = None  # Port to serve Prometheus metrics on, see start_metrics
+METRICS_FILE = None  # File to dump the metrics to every Metrics.DUMP_INTERVAL seconds
+METRICS_EXPORTERS = []
+METERS = {}
+USERS = constants.Population.USERS  # Size of the user population, see build_population
+POPULATION = None
 
 
 # TODO: create package/setup and move run code into __main__ module
 # XXX: can this be reworked to also be extended by LogWriter?
-class LogGenerator(threading.Thread):
+class LogGenerator:
+    """
+    Base class for log generating flows driven by SCHEDULER.
+
+    run() is a generator which yields the number of seconds to wait before it is next resumed. Each flow
+    draws from its own random stream, so what one flow generates doesn't depend on how the scheduler
+    interleaves it with others.
 
-    THREADS = []
+    Flows are kept small, with __slots__ rather than an instance dict, as there can be hundreds of
+    thousands in flight.
+    """
+
+    __slots__ = ('rng', '_id', '_stopped')
+    FLOWS = []
+
+    def __init__(self, rng=None):
+        """
+        :param rng: random.Random stream for the flow, defaults to one seeded from RNG.
+        """
+        self.rng = rng if rng is not None else Random(RNG.getrandbits(64))
+        self._id = self.rng.getrandbits(128)
+        self._stopped = False
 
-    def __init__(self):
-        threading.Thread.__init__(self)
-        self.thread_id = uuid.uuid4()
-        self._stop_event = threading.Event()
-        self.setDaemon(True)
+    @property
+    def flow_id(self):
+        return uuid.UUID(int=self._id, version=4)
 
     def run(self):
-        print("Starting thread %s" % self.thread_id)
-        while not self._stop_event.is_set():
+        print("Starting flow %s" % self.flow_id)
+        while not self._stopped:
             try:
                 self._generate()
             except Exception as e:
                 print(e)
-            time.sleep(1)
+            yield 1
 
     def stop(self):
-        self._stop_event.set()
+        self._stopped = True
 
     def _generate(self):
         pass
 
     @classmethod
-    def spawn_threads(cls, count, lifetime=0):
+    def spawn_flows(cls, count):
         """
-        Spawn additional OAuthTransactionGenerator threads.
+        Spawn additional flows on the scheduler.
 
-        :param count: Number of threads to spawn.
-        :param lifetime: If a lifetime greater than 0 is given, automatically kills the
-                         spawned threads after lifetime seconds Defaults to 0.
+        :param count: Number of flows to spawn.
         """
         for n in range(count):
-            cls()
-            time.sleep(random() * 2)  # Stagger threads
-
-        if lifetime > 0:
-            events.spawn_timer(lifetime, cls.kill_threads, count)
+            # Stagger flows, but have them all running by the time the usage curve is next evaluated
+            SCHEDULER.spawn(cls().run(), RNG.random() * constants.Usage.CURVE_INTERVAL)
 
     @classmethod
-    def kill_threads(cls, count=0):
-        count = len(cls.THREADS) if count <= 0 else count
-        killed_threads = []
-
-        for n in range(count):
-            t = cls.THREADS.pop()
-            t.stop()
-            killed_threads.append(t)
+    def kill_flows(cls, count=0):
+        """
+        Stop flows; each one finishes its in-flight step and is then dropped by the scheduler.
+        """
+        count = len(cls.FLOWS) if count <= 0 else count
 
-        for t in killed_threads:
-            t.join()
-            print("Stopped %s thread %s" % (cls.__name__, str(t.thread_id)))
+        for n in range(min(count, len(cls.FLOWS))):
+            f = cls.FLOWS.pop()
+            f.stop()
+            print("Stopped %s flow %s" % (cls.__name__, str(f.flow_id)))
 
 
 class OSLogGenerator(LogGenerator):
-
-    THREADS = []
+    """
+    Writes df, cpu and mem rows for a fleet of hosts every OS_METRIC_GENERATION_INTERVAL seconds from a
+    single flow.
+
+    Each host is given a random phase within the interval so the fleet's rows are spread across it
+    rather than all written on the same instant. The flow steps every OS_METRIC_TICK seconds and writes
+    the rows of the hosts whose phase falls within the step, stamped with their own times, in one batch
+    per log. Hosts' disk cleanups are run from the same flow every DISK_CLEANUP_INTERVAL seconds.
+    """
+
+    __slots__ = ('hosts', '_slots')
+    FLOWS = []
     DISK_USAGE_LOGGER = None
     CPU_USAGE_LOGGER = None
     MEMORY_USAGE_LOGGER = None
 
-    def __init__(self, host):
+    def __init__(self, hosts):
         LogGenerator.__init__(self)
-        self.host = host
-        OSLogGenerator.THREADS.append(self)
+        self.hosts = hosts
+        slots = max(1, round(constants.OS_METRIC_GENERATION_INTERVAL / constants.OS_METRIC_TICK))
+        # Hosts due in each step of the interval, as (offset into the step, host) in time order
+        self._slots = [[] for n in range(slots)]
+        for host in hosts:
+            phase = RESOURCES_BY_HOST[host].rng.random() * slots
+            self._slots[int(phase)].append(((phase % 1) * constants.OS_METRIC_TICK, host))
+        for slot in self._slots:
+            slot.sort()
+        OSLogGenerator.FLOWS.append(self)
         self._init_loggers()
-        self.start()
 
     @staticmethod
     def _init_loggers():
@@ -110,41 +151,57 @@ class OSLogGenerator(LogGenerator):
             OSLogGenerator.MEMORY_USAGE_LOGGER = LOGGERS.get(constants.Logs.MEMORY_USAGE_LOG)
 
     def run(self):
-        print("Starting OS log thread %s" % self.thread_id)
-        while not self._stop_event.is_set():
+        print("Starting OS log flow %s for %d hosts" % (self.flow_id, len(self.hosts)))
+        start = clock.now()
+        cleanup_every = max(1, round(constants.DISK_CLEANUP_INTERVAL / constants.OS_METRIC_GENERATION_INTERVAL))
+        step = 0
+        while not self._stopped:
+            interval, slot = divmod(step, len(self._slots))
             try:
-                self._generate()
+                self._generate(start + step * constants.OS_METRIC_TICK, self._slots[slot],
+                               cleanup=interval and not interval % cleanup_every)
             except Exception as e:
                 print(e)
-            time.sleep(constants.OS_METRIC_GENERATION_INTERVAL)
-
-    def stop(self):
-        self._stop_event.set()
+            step += 1
+            # Step on a fixed grid so timestamps don't drift however late the scheduler runs us
+            yield max(start + step * constants.OS_METRIC_TICK - clock.now(), 0)
 
-    def disk_cleanup(self):
-        DISK_USAGE_BY_HOST[self.host] = randint(constants.Disk.MIN_BASE_USAGE, constants.Disk.MAX_BASE_USAGE)
-        events.spawn_timer(3600 * 2, self.disk_cleanup)  # Recurring cleanup every 2 hours
+    def _generate(self, t, hosts, cleanup=False):
+        """
+        Write the rows of hosts due in the step starting at t.
 
-    def _generate(self):
-        df_entry = self._df_entry()  # TODO: mock FS/disk size/mount path for multiple disks on each host
-        cpu_entry = self._cpu_entry(nice=random() * constants.Cpu.NICE_MAX,
-                                    system=random() * constants.Cpu.SYS_MAX,
-                                    wait=random() * constants.Cpu.WAIT_MAX)
-        mem_entry = self._mem_entry()
-        OSLogGenerator.DISK_USAGE_LOGGER.write(df_entry)
-        OSLogGenerator.CPU_USAGE_LOGGER.write(cpu_entry)
-        OSLogGenerator.MEMORY_USAGE_LOGGER.write(mem_entry)
-
-    def _df_entry(self, file_system=None, disk_size=None, mount_path=None):
+        :param hosts: (offset into the step, host) pairs.
+        :param cleanup: Clean up the hosts' disks first.
+        """
+        if not hosts:
+            return
+        df_entries, cpu_entries, mem_entries = [], [], []
+        for offset, host in hosts:
+            resources = RESOURCES_BY_HOST[host]
+            if cleanup:
+                resources.cleanup_disk()
+            timestamp = util.timestamp(t + offset)
+            # TODO: mock FS/disk size/mount path for multiple disks on each host
+            df_entries.append(self._df_entry(host, timestamp))
+            cpu_entries.append(self._cpu_entry(host, timestamp,
+                                               nice=resources.rng.random() * constants.Cpu.NICE_MAX,
+                                               system=resources.rng.random() * constants.Cpu.SYS_MAX,
+                                               wait=resources.rng.random() * constants.Cpu.WAIT_MAX))
+            mem_entries.append(self._mem_entry(host, timestamp))
+        OSLogGenerator.DISK_USAGE_LOGGER.write(''.join(df_entries), len(hosts))
+        OSLogGenerator.CPU_USAGE_LOGGER.write(''.join(cpu_entries), len(hosts))
+        OSLogGenerator.MEMORY_USAGE_LOGGER.write(''.join(mem_entries), len(hosts))
+
+    def _df_entry(self, host, timestamp, file_system=None, disk_size=None, mount_path=None):
         size = disk_size or constants.Disk.DISK_SIZE_DEFAULT
-        usage_percentage = math.ceil(DISK_USAGE_BY_HOST[self.host])
+        usage_percentage = math.ceil(RESOURCES_BY_HOST[host].disk)
         used = math.floor((usage_percentage * size) / 100)
         available_space = size - used
         # timestamp                 host                fs          size        used    avail   %used   mnt
         # 2018-09-18 20:13:16,390   solsyspingfed7		none		100G		6G		94G		6%		/
         return '%s\t\t%s\t\t%s\t\t%sG\t\t%sG\t\t%sG\t\t%s%%\t\t%s\r\n' % (
-            util.timestamp(),
-            self.host,
+            timestamp,
+            host,
             file_system or constants.Disk.FILESYSTEM_DEFAULT,
             size,
             used,
@@ -153,352 +210,653 @@ class OSLogGenerator(LogGenerator):
             mount_path or constants.Disk.MOUNT_PATH_DEFAULT
         )
 
-    def _cpu_entry(self, core=None, nice=None, system=None, wait=None):
-        usr = CPU_USAGE_BY_HOST[self.host]
+    def _cpu_entry(self, host, timestamp, core=None, nice=None, system=None, wait=None):
+        usr = RESOURCES_BY_HOST[host].cpu
         nice = nice or constants.Cpu.DEFAULT_NICE
         system = system or constants.Cpu.DEFAULT_SYS
         wait = wait or constants.Cpu.DEFAULT_WAIT
+        usr = min(usr, 100 - (nice + system + wait))  # A busy host runs out of idle time, not past it
         # timestamp                 host              core     %usr       %nice   %sys    %wait   %idle
         # 2018-09-18 20:13:16,390   solsyspingfed1    all      31.39      0.00    9.62    5.95    53.04
         return '%s\t\t%s\t\t%s\t\t%.2f\t\t%.2f\t\t%.2f\t\t%.2f\t\t%.2f\r\n' % (
-            util.timestamp(),
-            self.host,
+            timestamp,
+            host,
             core or constants.Cpu.ALL,
             usr,
             nice,
             system,
             wait,
-            100 - (usr + nice + system + wait)
+            max(100 - (usr + nice + system + wait), 0)  # Not -0.00 from rounding once usr is capped
         )
 
-    def _mem_entry(self, mem_total=None, processes=None, threads=None, interrupts=None):
-        mem_used = MEMORY_USAGE_BY_HOST[self.host]
+    def _mem_entry(self, host, timestamp, mem_total=None, processes=None, threads=None, interrupts=None):
+        resources = RESOURCES_BY_HOST[host]
+        mem_used = resources.memory
         mem_total = mem_total or constants.Memory.DEFAULT_TOTAL
         mem_free = mem_total - mem_used
         free_percentage = mem_free / mem_total * 100
         used_percentage = 100 - free_percentage
-        with LOCK:
-            recent_tx_count = len(RECENT_TRANSACTION_CACHE_BY_HOST[self.host].entries())
         # memTotalMB    memFreeMB   memUsedMB  memFreePct  memUsedPct   processes   threads  interrupts_PS
         # 32158         30599       1558       95.2        4.8          200         494      650.00
         return '%s\t\t%s\t\t%s\t\t%s\t\t%s\t\t%.1f\t\t%.1f\t\t%s\t\t%s\t\t%.2f\r\n' % (
-            util.timestamp(),
-            self.host,
+            timestamp,
+            host,
             mem_total,
             mem_free,
             mem_used,
             free_percentage,
             used_percentage,
-            # XXX: should these values be constants?
-            processes or randint(constants.Memory.MIN_PROCESSES, constants.Memory.MAX_PROCESSES) + recent_tx_count,
-            threads or randint(constants.Memory.MIN_THREADS, constants.Memory.MAX_THREADS) + recent_tx_count * 2,
-            interrupts or randint(constants.Memory.MIN_INTERRUPTS, constants.Memory.MAX_INTERRUPTS)
+            processes or resources.processes(),
+            threads or resources.threads(),
+            interrupts or resources.rng.randint(constants.Memory.MIN_INTERRUPTS, constants.Memory.MAX_INTERRUPTS)
         )
 
     @classmethod
-    def spawn_threads(cls, count, lifetime=0):
-        pass  # OS log threads are created separately so one is assigned to each host
+    def spawn_flows(cls, count):
+        pass  # The OS log flow is created separately, covering every host
 
 
 class OAuthTransactionGenerator(LogGenerator):
+    """
+    A simulated client running OAuth transactions back to back.
+
+    Every wait in the transaction state machine is a yield back to SCHEDULER rather than a sleep.
+    """
 
-    THREADS = []
+    __slots__ = ('logger', 'tid', 'user', 'ip', 'client', 'host', 'adapter_id', 'events')
+    FLOWS = []
 
-    def __init__(self):
+    def __init__(self, register=True):
+        """
+        :param register: Track the flow in FLOWS so kill_flows can stop it. One-shot transactions
+                         started by the rate controller end by themselves and aren't tracked.
+        """
         LogGenerator.__init__(self)
         self.logger = LOGGERS.get(constants.Logs.AUDIT_LOG)
         self.tid = self.user = self.ip = self.client = self.host = self.adapter_id = None
-        self.event = constants.Events.OAUTH
-        self.role = constants.Roles.AS
-        self.protocol = constants.Protocols.OAUTH2
-        self.status = constants.Statuses.SUCCESS
-        OAuthTransactionGenerator.THREADS.append(self)
-        self.start()
+        self.events = 0
+        if register:
+            OAuthTransactionGenerator.FLOWS.append(self)
 
     def _scramble(self):
         """
-        Scramble the random values in the generator to mock a new transaction in the thread.
+        Scramble the random values in the generator to mock a new transaction in the flow.
         """
-        self.tid = util.Mock.tid()
-        self.user = util.Mock.user()
-        self.ip = util.Mock.ip_address()
-        self.client = util.Mock.client()
-        self.host = util.Mock.host()
-        self.adapter_id = util.Mock.adapter()
+        self.tid = util.Mock.tid(self.rng)
+        self.user, self.ip, self.client, self.adapter_id = POPULATION.draw(self.rng)
+        self.host = util.Mock.host(self.rng)
 
     def _mock_usage(self):
-        # TODO: have a timed decrease in disk usage (rollover archiving, cold storage, periodic removal etc.)
-        # TODO: simulate CPU/Memory flapping?
-        with LOCK:
-            RECENT_TRANSACTION_CACHE_BY_HOST[self.host].add('placeholder')  # FIXME
-            recent_tx_count = len(RECENT_TRANSACTION_CACHE_BY_HOST[self.host].entries())
-        DISK_USAGE_BY_HOST[self.host] += constants.Disk.USAGE_INCREMENT_PER_TRANSACTION
-        if DISK_USAGE_BY_HOST[self.host] >= 100:
-            DISK_USAGE_BY_HOST[self.host] = 100
-            # TODO: generate disk usage errors in server.log
-        # wobble the base values and add a multiplier based on transactions in the last n minutes
-        cpu = reduce(lambda x, y: x + random() * constants.Cpu.MAX_USAGE_PER_TRANSACTION, range(recent_tx_count), 0)
-        CPU_USAGE_BY_HOST[self.host] = randint(constants.Cpu.MIN_BASE_USAGE, constants.Cpu.MAX_BASE_USAGE) + cpu
-        mem = reduce(lambda x, y: x + math.ceil(random() * constants.Memory.MAX_USAGE_PER_TRANSACTION),
-                     range(recent_tx_count), 0)
-        MEMORY_USAGE_BY_HOST[self.host] = randint(constants.Memory.MIN_BASE_USAGE, constants.Memory.MAX_BASE_USAGE) + mem
+        RESOURCES_BY_HOST[self.host].transaction()
 
     def run(self):
-        print("Starting thread %s" % self.thread_id)
-        while not self._stop_event.is_set():
+        """
+        Flow body: run transactions until stopped, yielding the delay before each next step.
+        """
+        print("Starting flow %s" % self.flow_id)
+        while not self._stopped:
             try:
-                self._scramble()
-                self._generate()
-                self._mock_usage()
+                yield from self._transaction()
             except Exception as e:
                 print(e)
-            time.sleep(randint(1, 3))
+            yield self.rng.randint(1, 3)
 
-    def stop(self):
-        self._stop_event.set()
+    def _transaction(self):
+        """
+        Run a single transaction.
+
+        :return: Number of audit events written.
+        """
+        self.events = 0
+        self._scramble()
+        yield from self._generate()
+        self._mock_usage()
+        return self.events
+
+    @classmethod
+    def one_shot(cls):
+        """
+        Flow running a single transaction, for the rate controller.
+        """
+        return cls(register=False)._transaction()
+
+    @classmethod
+    def spawn_flows(cls, count):
+        if COORDINATOR is not None:
+            COORDINATOR.send('spawn', count)  # Shard workers run the flows
+            return
+        super(OAuthTransactionGenerator, cls).spawn_flows(count)
+
+    @classmethod
+    def kill_flows(cls, count=0):
+        if COORDINATOR is not None:
+            if count > 0:
+                COORDINATOR.send('kill', count)
+            return
+        super(OAuthTransactionGenerator, cls).kill_flows(count)
 
     @staticmethod
-    def usage_curve():
-        # FIXME: change this function to ramp to the expected value for the current time rather than running once a day
-        events.spawn_timer(3600 * 24, OAuthTransactionGenerator.usage_curve)  # Re-run in 24 hours
-        # Initial wind-up for the first few hours of the day
-        windup_intervals = ((constants.Usage.PEAK_TIME - constants.Usage.KICKOFF_TIME)
-                            * (60 // constants.Usage.INCREASE_INTERVAL))
-        lifetime = (constants.Usage.DROPOFF_TIME - constants.Usage.KICKOFF_TIME) * 3600
-        for n in range(windup_intervals):
-            new_threads = randint(constants.Usage.INCREASE_VOLUME - math.floor(constants.Usage.INCREASE_VOLUME / 2),
-                                  constants.Usage.INCREASE_VOLUME + math.floor(constants.Usage.INCREASE_VOLUME / 2))
-            # Assign a finite lifetime to the threads so we kill them off by the end of the day
-            OAuthTransactionGenerator.spawn_threads(new_threads, lifetime=lifetime)
-            time.sleep(randint(constants.Usage.INCREASE_INTERVAL - math.floor(constants.Usage.INCREASE_INTERVAL / 2),
-                               constants.Usage.INCREASE_INTERVAL + math.floor(constants.Usage.INCREASE_INTERVAL / 2))
-                       * 60)  # Sleep a few minutes until the next interval
+    def usage_curve(base):
+        """
+        Keep the number of flows on the daily usage curve, run as a flow on the scheduler.
+
+        Every Usage.CURVE_INTERVAL seconds the expected number of flows for the current time is worked out
+        from the curve and flows are spawned or killed to match, so load is right from whenever
+        generation starts.
+
+        :param base: Number of flows outside of the curve.
+        """
+        flows = 0
+        while True:
+            target = base + round(constants.Usage.PEAK_FLOWS * rate.usage_level(clock.now()))
+            if target > flows:
+                OAuthTransactionGenerator.spawn_flows(target - flows)
+            elif target < flows:
+                OAuthTransactionGenerator.kill_flows(flows - target)
+            flows = target
+            yield constants.Usage.CURVE_INTERVAL
 
     @staticmethod
     def disk_overflow():
         pass  # TODO
 
     def _generate(self):
-        self.logger.write(self._authn_start())
-        time.sleep(randint(constants.OAuth.MIN_AUTHN_TIME, constants.OAuth.MAX_AUTHN_TIME))
+        yield from self._write(templates.AUTHN_START)
+        yield self.rng.randint(constants.OAuth.MIN_AUTHN_TIME, constants.OAuth.MAX_AUTHN_TIME)
         # XXX: should this be using a separate library to generate % failures?
-        # FIXME: this function is ugly
-        if random() > .90:
-            self.logger.write(self._authn_failure())
+        if self.rng.random() > .90:
+            yield from self._write(templates.AUTHN_FAILURE)
             return
-        self.logger.write(self._authn_success())
-        if random() > .90:
-            self.logger.write(self._authz_code_failure())
+        yield from self._write(templates.AUTHN_SUCCESS)
+        if self.rng.random() > .90:
+            description = self.rng.choice(templates.AUTHZ_CODE_FAILURE_DESCRIPTIONS)
+            yield from self._write(templates.AUTHZ_CODE_FAILURE, description)
             return
-        if random() > .92:
-            time.sleep(constants.OAuth.AUTH_CODE_LIFETIME)
-            self.logger.write(self._authz_code_expiry())
+        if self.rng.random() > .92:
+            yield constants.OAuth.AUTH_CODE_LIFETIME
+            yield from self._write(templates.AUTHZ_CODE_EXPIRY)
             return
-        self.logger.write(self._authz_code_request())
+        yield from self._write(templates.AUTHZ_CODE_REQUEST)
         # TODO: additional failures here (incorrect credentials / redirect)
-        self.logger.write(self._token_request())
-        if random() > .97:
-            time.sleep(constants.OAuth.ACCESS_TOKEN_LIFETIME)
-            self.logger.write(self._introspection_expiry())
+        yield from self._write(templates.TOKEN_REQUEST)
+        if self.rng.random() > .97:
+            yield constants.OAuth.ACCESS_TOKEN_LIFETIME
+            yield from self._write(templates.INTROSPECTION_EXPIRY)
             return
-        self.logger.write(self._introspection())
-        if random() > .97:
-            time.sleep(constants.OAuth.ACCESS_TOKEN_LIFETIME)
-            self.logger.write(self._validation_expiry())
+        yield from self._write(templates.INTROSPECTION)
+        if self.rng.random() > .97:
+            yield constants.OAuth.ACCESS_TOKEN_LIFETIME
+            yield from self._write(templates.VALIDATION_EXPIRY)
             return
-        self.logger.write(self._validation())
-        time.sleep(randint(constants.OAuth.MIN_REFRESH_TIME, constants.OAuth.MAX_REFRESH_TIME))
-        if random() > .98:
-            time.sleep(constants.OAuth.REFRESH_TOKEN_LIFETIME)
-            self.logger.write(self._refresh_token_failure())
+        yield from self._write(templates.VALIDATION)
+        yield self.rng.randint(constants.OAuth.MIN_REFRESH_TIME, constants.OAuth.MAX_REFRESH_TIME)
+        if self.rng.random() > .98:
+            yield constants.OAuth.REFRESH_TOKEN_LIFETIME
+            yield from self._write(templates.REFRESH_TOKEN_FAILURE)
             return
-        self.logger.write(self._refresh())
-
-    # FIXME: all of these functions are samey; should find a way to merge them
-    def _authn_start(self):
-        return self._audit_entry(
-            event=constants.Events.AUTHENTICATION_ATTEMPT,
-            user="",
-            protocol="",
-            role=constants.Roles.IDP,
-            status=constants.Statuses.IN_PROGRESS
-        )
+        yield from self._write(templates.REFRESH)
 
-    def _authn_success(self):
-        return self._audit_entry(
-            event=constants.Events.AUTHENTICATION_ATTEMPT,
-            client="",
-            protocol="",
-            role=constants.Roles.IDP
-        )
-
-    def _authn_failure(self):
-        return self._audit_entry(
-            event=constants.Events.AUTHENTICATION_ATTEMPT,
-            client="",
-            protocol="",
-            role=constants.Roles.IDP,
-            status=constants.Statuses.IN_PROGRESS
-        )
-
-    def _authz_code_request(self):
-        return self._audit_entry(
-            grant_type=constants.GrantTypes.AUTH_CODE
-        )
-
-    def _authz_code_failure(self):
-        return self._audit_entry(
-            grant_type=constants.GrantTypes.AUTH_CODE,
-            status=constants.Statuses.FAILURE,
-            description=choice([
-                constants.Errors.INVALID_CLIENT_ID,
-                constants.Errors.INVALID_SCOPE,
-                constants.Errors.INVALID_SECRET
-            ])
-        )
-
-    def _authz_code_expiry(self):
-        return self._audit_entry(
-            grant_type=constants.GrantTypes.AUTH_CODE,
-            status=constants.Statuses.FAILURE,
-            description=constants.Errors.AUTHZ_CODE_EXPIRED
-        )
-
-    def _token_request(self):
-        return self._audit_entry(
-            grant_type=constants.GrantTypes.AUTH_CODE,
-            adapter_id=""
-        )
-
-    def _introspection(self):
-        return self._audit_entry(
-            client=constants.Clients.RS_CLIENT,
-            adapter_id=""
-        )
-
-    def _introspection_expiry(self):
-        return self._audit_entry(
-            client=constants.Clients.RS_CLIENT,
-            adapter_id="",
-            status=constants.Statuses.FAILURE,
-            description=constants.Errors.TOKEN_EXPIRED
-        )
-
-    def _validation(self):
-        return self._audit_entry(
-            client=constants.Clients.RS_CLIENT,
-            grant_type=constants.GrantTypes.VALIDATE_BEARER,
-            adapter_id=""
-        )
-
-    def _validation_expiry(self):
-        return self._audit_entry(
-            client=constants.Clients.RS_CLIENT,
-            grant_type=constants.GrantTypes.VALIDATE_BEARER,
-            adapter_id="",
-            status=constants.Statuses.FAILURE,
-            description=constants.Errors.TOKEN_EXPIRED
-        )
-
-    def _refresh(self):
-        return self._audit_entry(
-            grant_type=constants.GrantTypes.REFRESH,
-            adapter_id=""
-        )
+    def _write(self, template, description=""):
+        """
+        Wait out a mock response time, then write the audit line for a step of the transaction.
 
-    def _refresh_token_failure(self):
-        return self._audit_entry(
-            grant_type=constants.GrantTypes.AUTH_CODE,
-            status=constants.Statuses.FAILURE,
-            adapter_id="",
-            description=constants.Errors.INVALID_REFRESH_TOKEN
-        )
+        :param template: One of the step templates in the templates module.
+        :param description: Description for templates which don't fix one.
+        """
+        response_time = util.Mock.response_time(self.rng)
+        yield response_time / 1000
+        self.events += 1
+        self.logger.write(template(util.timestamp(), self.tid, self.user, self.ip, self.client, self.host,
+                                   self.adapter_id, response_time, description))
+
+
+def start_writers(shard=None, merge=False):
+    """
+    Start a LogWriter for each log, keyed by its path in constants.Logs.
+
+    :param shard: Index of the shard worker writing the logs, if any.
+    :param merge: If set, shard workers append to the common log files rather than their own copies.
+    """
+    for log in constants.Logs.ALL:
+        flush_size, flush_interval = constants.Logs.FLUSH_POLICIES[log]
+        max_queue, overflow = constants.Logs.QUEUE_POLICIES[log]
+        path = log if LOG_DIR is None else os.path.join(LOG_DIR, os.path.basename(log))
+        path = path if shard is None or merge else shards.shard_log(path, shard)
+        shared = shard is not None and merge
+        sink = sinks.from_spec(constants.Logs.SINKS[log], path, shared, constants.Logs.ROTATION_POLICIES[log])
+        if isinstance(SCHEDULER, AsyncioScheduler):
+            LOGGERS[log] = AsyncLogWriter(SCHEDULER.loop, path, flush_size, flush_interval, shared, max_queue,
+                                          overflow, sink)
+        else:
+            LOGGERS[log] = LogWriter(path, flush_size, flush_interval, shared, max_queue, overflow, sink)
+
+
+def schedule_load():
+    if RATE is not None:
+        if COORDINATOR is None:
+            start_rate_controller()
+        return  # Shard workers each pace their own share of the rate
+
+    # Spawn transaction generation flows and follow the usage curve from now on
+    base = RNG.randint(constants.OAuth.TXN_MIN_THREADS, constants.OAuth.TXN_MAX_THREADS)
+    SCHEDULER.spawn(OAuthTransactionGenerator.usage_curve(base))
 
-    def _audit_entry(
-            self,
-            role=None,
-            event=None,
-            user=None,
-            client=None,
-            protocol=None,
-            grant_type="",
-            status=None,
-            adapter_id=None,
-            description=""):
-        response_time = util.Mock.response_time()
-        time.sleep(response_time / 1000)
-        timestamp = util.timestamp()
-        # FIXME: this function is ugly
-        return "%s| tid:%s| %s| %s| %s| %s| %s| %s| %s| %s| %s| %s| %s| %s| %s\r\n" % (
-            timestamp,
-            self.tid,
-            event if event is not None else self.event,
-            user if user is not None else self.user,
-            self.ip,
-            "",
-            client if client is not None else self.client,
-            protocol if protocol is not None else self.protocol,
-            grant_type,
-            self.host,
-            role if role is not None else self.role,
-            status if status is not None else self.status,
-            adapter_id if adapter_id is not None else self.adapter_id,
-            description,
-            response_time
-        )
+    # TODO: create recurring error events
+    events.spawn_recurring(3600 * 24, OAuthTransactionGenerator.disk_overflow)
+
+
+def start_rate_controller(share=1):
+    global RATE_CONTROLLER
+    eps, peak_eps = RATE
+    RATE_CONTROLLER = rate.RateController(SCHEDULER, OAuthTransactionGenerator.one_shot,
+                                          LOGGERS[constants.Logs.AUDIT_LOG], eps, peak_eps, share,
+                                          Random(RNG.getrandbits(64)))
+    SCHEDULER.spawn(RATE_CONTROLLER.run())
+
+
+def build_population():
+    """
+    Generate the users transactions are drawn from, once: shard workers inherit the coordinator's.
+    """
+    global POPULATION
+    if POPULATION is None:
+        POPULATION = population.Population(USERS, util.rng('population'))
+
+
+def start_os_metrics():
+    SCHEDULER.spawn(OSLogGenerator(util.Mock.HOSTS).run())
+
+
+def collect_metrics():
+    """
+    Metric families describing the generator's internals, see metrics.render.
+    """
+    logs = [(os.path.basename(path), logger) for path, logger in sorted(LOGGERS.items())]
+    families = [
+        ('mockgen_log_lines_total', 'counter', 'Records submitted to each log.',
+         [({'log': log}, w.records) for log, w in logs]),
+        ('mockgen_log_bytes_total', 'counter', 'Bytes written to each log.',
+         [({'log': log}, w.bytes) for log, w in logs]),
+        ('mockgen_log_lines_per_second', 'gauge', 'Records submitted to each log per second.',
+         [({'log': log}, _meter((log, 'lines'), w.records)) for log, w in logs]),
+        ('mockgen_log_bytes_per_second', 'gauge', 'Bytes written to each log per second.',
+         [({'log': log}, _meter((log, 'bytes'), w.bytes)) for log, w in logs]),
+        ('mockgen_log_queue_depth', 'gauge', 'Records waiting on each log writer\'s queue.',
+         [({'log': log}, w.backlog()) for log, w in logs]),
+        ('mockgen_log_overflow_total', 'counter', 'Records each log writer blocked on, dropped or spilled.',
+         [({'log': log, 'outcome': outcome}, getattr(w, outcome))
+          for log, w in logs for outcome in ('blocked', 'dropped', 'spilled')]),
+        ('mockgen_log_rotations_total', 'counter', 'Rotations of each log.',
+         [({'log': log}, w.sink.rotations) for log, w in logs]),
+        ('mockgen_log_write_seconds', 'histogram',
+         'Time taken to queue a record, sampled one in %d.' % constants.Metrics.WRITE_SAMPLE,
+         [({'log': log}, w.write_latency) for log, w in logs]),
+        ('mockgen_log_flush_seconds', 'histogram', 'Time taken to write a batch of records to the sink.',
+         [({'log': log}, w.flush_latency) for log, w in logs]),
+        ('mockgen_flows', 'gauge', 'Active flows of each generator.',
+         [({'generator': cls.__name__}, len(cls.FLOWS)) for cls in (OAuthTransactionGenerator, OSLogGenerator)]),
+        ('mockgen_hosts', 'gauge', 'Mock hosts generated for.', [({}, len(util.Mock.HOSTS))]),
+        ('mockgen_host_recent_transactions', 'gauge', 'Transactions completed on each host in the last %d seconds.'
+         % constants.OAuth.TXN_CACHE_TTL,
+         [({'host': host}, RESOURCES_BY_HOST[host].recent_transactions.peek()) for host in util.Mock.HOSTS]),
+        ('mockgen_scheduler_pending', 'gauge', 'Entries waiting on the scheduler.', [({}, SCHEDULER.pending())])
+    ]
+    if RATE_CONTROLLER is not None:
+        families += [
+            ('mockgen_rate_target_eps', 'gauge', 'Audit events per second the rate controller is aiming for.',
+             [({}, RATE_CONTROLLER.target())]),
+            ('mockgen_rate_transactions_in_flight', 'gauge', 'Transactions started and not yet completed.',
+             [({}, RATE_CONTROLLER.started - RATE_CONTROLLER.completed)]),
+            ('mockgen_rate_throttled_total', 'counter', 'Ticks the rate controller held back for the writer.',
+             [({}, RATE_CONTROLLER.throttled)])
+        ]
+    return families
+
+
+def _meter(key, value):
+    if key not in METERS:
+        METERS[key] = metrics.Meter()
+    return METERS[key].rate(value)
+
+
+def start_metrics(shard=None):
+    """
+    Serve collect_metrics() on METRICS_PORT and dump it to METRICS_FILE, where set. Shard workers serve on
+    METRICS_PORT + shard and dump to METRICS_FILE.shardN.
+    """
+    try:
+        if METRICS_PORT is not None:
+            port = METRICS_PORT + (shard or 0)
+            METRICS_EXPORTERS.append(metrics.Server(collect_metrics, port))
+            print("Serving metrics on http://127.0.0.1:%d/metrics" % port)
+        if METRICS_FILE is not None:
+            path = METRICS_FILE if shard is None else '%s.shard%d' % (METRICS_FILE, shard)
+            METRICS_EXPORTERS.append(metrics.Dumper(collect_metrics, path))
+    except OSError as e:
+        print(e)
 
 
 def run():
-    # Initialize logger threads
-    # FIXME: figure out a nicer way to do this!
-    for k, log in constants.Logs.__dict__.items():
-        if not str(k).startswith('__') and not callable(log):
-            l = LogWriter(log)
-            LOGGERS[log] = l
-
-    # Spawn transaction generation threads
-    OAuthTransactionGenerator.spawn_threads(randint(constants.OAuth.TXN_MIN_THREADS, constants.OAuth.TXN_MAX_THREADS))
+    build_population()
+    start_writers()
+    start_metrics()
+    events.bind(SCHEDULER)
+    schedule_load()
 
     # Start OS metrics log generation
-    for host in util.Mock.HOSTS:
-        t = OSLogGenerator(host)
-        OS_METRIC_THREADS[host] = t
-
-    # Kick off the usage curve in the morning
-    events.spawn_timer(util.seconds_until(constants.Usage.KICKOFF_TIME), OAuthTransactionGenerator.usage_curve)
-
-    for host, t in OS_METRIC_THREADS.items():
-        events.spawn_timer(3600 * 2, t.disk_cleanup)  # Do disk cleanup every 2 hours
-
-    # TODO: create recurring error events
-    events.spawn_timer(3600 * 24, OAuthTransactionGenerator.disk_overflow)
+    start_os_metrics()
 
     # TODO: determine error events to simulate (core failure? PF outage? network failure?)
     # need to figure out
     # a) log entries (in PF?) for these failures
     # b) symptoms (KPIs)
 
-
-# Shutdown callback to gracefully stop running threads
-def shutdown(sig, frame):
-    print("shutting down")
-
+    SCHEDULER.start()
+
+
+def run_bulk(flows):
+    """
+    Backfill from the virtual clock's start to the scheduler's end time with vectorized synthesis.
+    """
+    import bulk  # Needs numpy, which only this mode depends on
+
+    start_writers()
+    start_metrics()
+    rng = bulk.np.random.default_rng(RNG.getrandbits(64))
+    bulk.Backfill(clock.now(), SCHEDULER.until, flows, rng=rng).run(LOGGERS)
+
+
+def run_replay(directory, speedup=1):
+    """
+    Re-emit the logs previously generated into directory, shifted to start now and sped up speedup times.
+    """
+    import replay
+
+    source = replay.Replay(directory, clock.now(), speedup)
+    logs = source.logs()
+    if not logs:
+        print("No logs to replay in %s" % directory)
+        return
+    start_writers()
+    start_metrics()
+    events.bind(SCHEDULER)
+
+    def done(log):
+        logs.remove(log)
+        if not logs:
+            SCHEDULER.stop()  # Don't wait for the end time once everything is written
+
+    def cut_off():
+        if logs:
+            print("Stopping the replay at --end with %s not fully replayed" % ', '.join(
+                os.path.basename(log) for log in logs))
+
+    for log in source.logs():
+        SCHEDULER.spawn(source.flow(log, LOGGERS[log], done))
+    if SCHEDULER.until is not None:
+        SCHEDULER.call_later(max(SCHEDULER.until - clock.now(), 0), cut_off)
+    SCHEDULER.start()
+
+
+def run_coordinator(shard_count, merge=False):
+    """
+    Run the usage curve in this process and generate logs in shard_count worker processes.
+    """
+    global COORDINATOR
+    build_population()
+    COORDINATOR = shards.Coordinator(shard_count, functools.partial(run_shard, merge=merge))
+    events.bind(SCHEDULER)
+    schedule_load()
+
+    if isinstance(clock.CLOCK, clock.VirtualClock) and not clock.CLOCK.speed:
+        # Workers can't follow an unpaced clock live, so plan the whole run up front and hand each
+        # worker its commands as it starts
+        start = clock.now()
+        SCHEDULER.run()
+        clock.install(clock.VirtualClock(start))
+        COORDINATOR.start(util.Mock.HOSTS)
+    else:
+        # Fork before starting any threads
+        COORDINATOR.start(util.Mock.HOSTS)
+        SCHEDULER.start()
+
+
+def run_shard(index, hosts, commands, backlog, merge=False):
+    """
+    Worker process entry point for sharded generation, see shards.Coordinator.
+    """
+    global COORDINATOR, SCHEDULER, RNG
+    # The coordinator owns signals and stops workers by ending their command queues
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    RNG = util.rng('shard', index)  # Don't repeat the random sequence inherited from the coordinator
+
+    share = 1 / COORDINATOR.shards
+    COORDINATOR = None
+    util.Mock.HOSTS = hosts
+    events.kill_timers()
+    SCHEDULER = type(SCHEDULER)(SCHEDULER.until)
+    events.bind(SCHEDULER)
+
+    start_writers(index, merge)
+    start_metrics(index)
+    for command in backlog:
+        apply_command(*command)
+    if RATE is not None:
+        start_rate_controller(share)
+    start_os_metrics()
+    SCHEDULER.start()
+
+    for command in iter(commands.get, None):
+        apply_command(*command)
+    if SCHEDULER.until is not None:
+        SCHEDULER.join()  # Finish the accelerated run
+    teardown()
+
+
+def apply_command(at, action, count, *args):
+    """
+    Apply a coordinator command at the clock time it was sent.
+    """
+    actions = {
+        'spawn': OAuthTransactionGenerator.spawn_flows,
+        'kill': OAuthTransactionGenerator.kill_flows
+    }
+    SCHEDULER.call_later(max(at - clock.now(), 0), actions[action], count, *args)
+
+
+def teardown():
+    # Stop the scheduler before clearing the timers and flows it runs, as this may be called on another thread
+    SCHEDULER.stop()
+    if SCHEDULER.is_alive():
+        SCHEDULER.join()
     events.kill_timers()
 
-    OSLogGenerator.kill_threads()
-    OAuthTransactionGenerator.kill_threads()
+    if RATE_CONTROLLER is not None:
+        RATE_CONTROLLER.stop()
+    OSLogGenerator.kill_flows()
+    OAuthTransactionGenerator.kill_flows()
+
+    if COORDINATOR is not None:
+        COORDINATOR.stop()
 
     for file, logger in LOGGERS.items():
         logger.stop()
 
-    for file, logger in LOGGERS.items():
+    for logger in LOGGERS.values():
         logger.join()
-        print("Stopped logger for " + file)
+        print("Stopped logger for %s (%d records, %d blocked, %d dropped, %d spilled)" % (
+            logger.log_file, logger.records, logger.blocked, logger.dropped, logger.spilled))
+
+    for exporter in METRICS_EXPORTERS:
+        exporter.stop()
+
+
+# Shutdown callback to gracefully stop running threads
+def shutdown(sig, frame):
+    print("shutting down")
+    # Ignore repeated signals so the handler cannot re-enter itself while joining threads
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    teardown()
 
     sys.exit(0)
 
-run()
-# Listen for a SIGINT or SIGTERM and trigger a shutdown if sent
-signal.signal(signal.SIGINT, shutdown)
-signal.signal(signal.SIGTERM, shutdown)
-signal.pause()
+
+def seed(value):
+    """
+    Derive every random stream from value so the same seed generates the same logs, see util.rng.
+    """
+    global RNG, RESOURCES_BY_HOST
+    util.SEED = value
+    RNG = util.rng('coordinator')
+    RESOURCES_BY_HOST = {h: HostResources(h) for h in util.Mock.HOSTS}
+
+
+def set_fleet(count):
+    """
+    Mock count hosts instead of the default util.Mock.HOSTS.
+    """
+    global RESOURCES_BY_HOST
+    util.Mock.HOSTS = util.Mock.fleet(count)
+    RESOURCES_BY_HOST = {h: HostResources(h) for h in util.Mock.HOSTS}
+
+
+def parse_time(value):
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError("invalid time '%s', expected YYYY-MM-DD [HH:MM:SS]" % value)
+
+
+def positive_int(value):
+    try:
+        n = int(value)
+    except ValueError:
+        n = 0
+    if n < 1:
+        raise argparse.ArgumentTypeError("invalid count '%s', expected a whole number of at least 1" % value)
+    return n
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Mock log generator for PingFederate audit logging and associated '
+                                                 'machine statistics')
+    parser.add_argument('--accelerated', action='store_true',
+                        help='run against a virtual clock from --start to --end instead of real time')
+    parser.add_argument('--start', type=parse_time, help='virtual clock start (YYYY-MM-DD [HH:MM:SS]), defaults to now')
+    parser.add_argument('--end', type=parse_time, help='virtual clock end, defaults to 24 hours after --start '
+                                                         '(or the end of the logs with --replay)')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='virtual seconds per real second; 0 (the default) generates as fast as possible')
+    parser.add_argument('--shards', type=positive_int, default=1,
+                        help='number of worker processes to partition hosts and transactions across')
+    parser.add_argument('--merge', action='store_true',
+                        help='have shards append to the common log files instead of a shardN directory each')
+    parser.add_argument('--eps', type=float,
+                        help='pace transactions to this many audit events per second instead of running a '
+                             'varying number of flows; with --peak-eps, the overnight rate (defaults to %s)'
+                             % constants.Rate.BASE_EPS)
+    parser.add_argument('--peak-eps', type=float,
+                        help='follow the daily usage curve from --eps up to this many audit events per second')
+    parser.add_argument('--seed', type=int,
+                        help='seed every random stream from this for reproducible output: with --accelerated, '
+                             '--start and no --speed a seed always writes the same logs, per shard with --shards')
+    parser.add_argument('--log-dir', help='directory to write logs to, defaults to %s' % constants.BASE_LOG_DIR)
+    parser.add_argument('--metrics', type=int, nargs='?', const=constants.Metrics.PORT, metavar='PORT',
+                        help='serve Prometheus metrics on http://127.0.0.1:PORT/metrics (default port %d); '
+                             'with --shards, shard N serves on PORT + N' % constants.Metrics.PORT)
+    parser.add_argument('--metrics-file',
+                        help='rewrite this file with the metrics every %d seconds, one file per shard with --shards'
+                             % constants.Metrics.DUMP_INTERVAL)
+    parser.add_argument('--hosts', type=positive_int,
+                        help='number of mock hosts to spread transactions over and write OS metrics for '
+                             '(defaults to %d)' % len(util.Mock.HOSTS))
+    parser.add_argument('--users', type=positive_int, default=constants.Population.USERS,
+                        help='number of distinct users transactions are drawn from, with Zipf-skewed popularity '
+                             '(defaults to %d)' % constants.Population.USERS)
+    parser.add_argument('--runtime', choices=('scheduler', 'asyncio'), default='scheduler',
+                        help='run flows and timers on the built-in scheduler (the default) or an asyncio event '
+                             'loop, with writers batching on the loop; asyncio needs real time or --speed')
+    parser.add_argument('--bulk', action='store_true',
+                        help='with --accelerated, synthesize logs in vectorized chunks as fast as possible '
+                             '(requires numpy)')
+    parser.add_argument('--flows', type=positive_int,
+                        help='number of transaction flows for --bulk outside of the daily usage curve, which '
+                             'adds up to %d more at peak; defaults to a random count between TXN_MIN_THREADS '
+                             'and TXN_MAX_THREADS' % constants.Usage.PEAK_FLOWS)
+    parser.add_argument('--replay', metavar='DIR',
+                        help='re-emit the logs previously generated into DIR (and their uncompressed rotated '
+                             'generations) instead of generating new ones, with timestamps shifted to start now '
+                             '(or at --start with --accelerated)')
+    parser.add_argument('--replay-rate', type=float, default=1,
+                        help='replay this many times faster than the logs were generated, compressing their '
+                             'timestamps to match')
+    args = parser.parse_args()
+    hosts = args.hosts if args.hosts is not None else len(util.Mock.HOSTS)
+    if args.shards > hosts:
+        parser.error('--shards %d leaves shards without hosts; use at most one shard per host (%d)'
+                     % (args.shards, hosts))
+    if args.bulk and (not args.accelerated or args.speed or args.shards > 1):
+        parser.error('--bulk needs --accelerated with no --speed and no --shards')
+    if args.bulk and (args.eps is not None or args.peak_eps is not None):
+        parser.error('--bulk generates a fixed number of flows, see --flows, rather than a target rate')
+    if args.runtime == 'asyncio' and (args.bulk or args.accelerated and not args.speed):
+        parser.error('--runtime asyncio keeps real time, so needs --speed with --accelerated')
+    if args.replay is not None and (args.bulk or args.shards > 1 or args.eps is not None or args.peak_eps is not None):
+        parser.error('--replay re-emits existing logs, so cannot be combined with --bulk, --shards or a target rate')
+    if args.replay is not None and not os.path.isdir(args.replay):
+        parser.error("--replay: '%s' is not a directory" % args.replay)
+    if args.replay is not None and os.path.realpath(args.replay) == os.path.realpath(
+            args.log_dir if args.log_dir is not None else constants.BASE_LOG_DIR):
+        parser.error('--replay needs a directory other than the one logs are written to')
+    if args.replay_rate <= 0:
+        parser.error('--replay-rate must be positive')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.seed is not None:
+        seed(args.seed)
+    if args.hosts is not None:
+        set_fleet(args.hosts)
+    USERS = args.users
+    METRICS_PORT = args.metrics
+    METRICS_FILE = args.metrics_file
+    if args.log_dir is not None:
+        os.makedirs(args.log_dir, exist_ok=True)
+        LOG_DIR = args.log_dir
+    if args.eps is not None or args.peak_eps is not None:
+        RATE = (args.eps if args.eps is not None else constants.Rate.BASE_EPS, args.peak_eps)
+    if args.accelerated:
+        start = args.start if args.start is not None else time.time()
+        clock.install(clock.VirtualClock(start, args.speed))
+        if args.end is not None:
+            SCHEDULER.until = args.end
+        elif args.replay is None:
+            SCHEDULER.until = start + 3600 * 24  # A replay runs until its logs are written instead
+    if args.runtime == 'asyncio':
+        SCHEDULER = AsyncioScheduler(SCHEDULER.until)
+
+    if args.bulk:
+        run_bulk(args.flows if args.flows is not None
+                 else RNG.randint(constants.OAuth.TXN_MIN_THREADS, constants.OAuth.TXN_MAX_THREADS))
+        shutdown(None, None)
+    if args.replay is not None:
+        run_replay(args.replay, args.replay_rate)
+    elif args.shards > 1:
+        run_coordinator(args.shards, args.merge)
+    else:
+        run()
+    # Listen for a SIGINT or SIGTERM and trigger a shutdown if sent
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    if args.accelerated or args.replay is not None:
+        if SCHEDULER.is_alive():
+            SCHEDULER.join()  # Returns once the virtual clock reaches the end time
+        shutdown(None, None)
+    signal.pause()
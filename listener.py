@@ -0,0 +1,93 @@
+#!/usr/bin/python3.5 -p
+
+import argparse
+import os
+import socket
+import sys
+import threading
+from urllib.parse import urlsplit
+
+
+def _output(args):
+    return open(args.output, 'ab', buffering=0) if args.output else sys.stdout.buffer
+
+
+def listen(address, output):
+    """
+    Receive from a sink address (udp://host:port, tcp://host:port, unix:///path or unixgram:///path) and
+    write what arrives to output, a line per syslog message or datagram, until interrupted.
+    """
+    url = urlsplit(address)
+    if url.scheme in ('udp', 'unixgram'):
+        if url.scheme == 'udp':
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.bind((url.hostname, url.port or 514))
+        else:
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            s.bind(url.path)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)  # Ride out bursts of datagrams
+        while True:
+            data = s.recv(65536)
+            output.write(data if data.endswith(b'\n') else data + b'\n')
+
+    if url.scheme == 'tcp':
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((url.hostname, url.port or 601))
+    elif url.scheme == 'unix':
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(url.path)
+    else:
+        raise ValueError("unknown address '%s'" % address)
+    s.listen(5)
+    lock = threading.Lock()  # Connections are served concurrently, so whole lines are written one at a time
+    while True:
+        conn, peer = s.accept()
+        # Each sink keeps its connection open, so give every connection its own thread
+        threading.Thread(target=_serve, args=(conn, url.scheme, output, lock), daemon=True).start()
+
+
+def _serve(conn, scheme, output, lock):
+    """
+    Write the lines arriving on an accepted connection to output until the sender closes it.
+    """
+    with conn:
+        f = conn.makefile('rb')
+        while True:
+            if scheme == 'unix':
+                line = f.readline()
+                if not line:
+                    break
+            else:
+                # Octet-counted syslog frames: "<length> <message>"
+                length = b''
+                while True:
+                    c = f.read(1)
+                    if not c or c == b' ':
+                        break
+                    length += c
+                if not length:
+                    break
+                line = f.read(int(length)) + b'\n'
+            with lock:
+                output.write(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Stand-in collector which receives from the network and socket '
+                                                 'sinks and writes what arrives to stdout or a file')
+    parser.add_argument('address', help='udp://host:port, tcp://host:port, unix:///path or unixgram:///path')
+    parser.add_argument('-o', '--output', help='file to append to instead of stdout')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    path = urlsplit(args.address).path
+    try:
+        listen(args.address, _output(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.address.startswith('unix') and os.path.exists(path):
+            os.remove(path)
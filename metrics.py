@@ -0,0 +1,154 @@
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import constants
+
+
+class Histogram:
+    """
+    Counts of observed values by bucket upper bound, rendered as a Prometheus histogram.
+
+    Like the writers' counters it is updated without a lock, from the thread doing the work.
+    """
+
+    def __init__(self, bounds=constants.Metrics.LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Meter:
+    """
+    Per second rate of a counter, measured in real time between readings at least window seconds
+    apart so that scrapes close together still see a steady rate.
+    """
+
+    def __init__(self, window=constants.Metrics.RATE_WINDOW):
+        self.window = window
+        self._previous = self._last = None
+
+    def rate(self, value):
+        now = time.monotonic()
+        if self._last is None:
+            self._previous = self._last = (now, value)  # Nothing to measure against yet
+        elif now - self._last[0] >= self.window:
+            self._previous, self._last = self._last, (now, value)
+        t, v = self._previous
+        return (value - v) / (now - t) if now > t else 0
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for k, v in sorted(labels.items()))
+
+
+def _value(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render(families):
+    """
+    Prometheus text exposition of metric families.
+
+    :param families: (name, type, help, samples) tuples, where samples are (labels, value) pairs and a
+                     histogram's values are Histograms.
+    """
+    lines = []
+    for name, kind, description, samples in families:
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in samples:
+            if kind != 'histogram':
+                lines.append('%s%s %s' % (name, _labels(labels), _value(value)))
+                continue
+            cumulative = 0
+            for bound, count in zip(list(value.bounds) + ['+Inf'], value.counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (name, _labels(dict(labels, le=bound)), cumulative))
+            lines.append('%s_sum%s %s' % (name, _labels(labels), _value(value.sum)))
+            lines.append('%s_count%s %d' % (name, _labels(labels), value.count))
+    return '\n'.join(lines) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render(self.server.collect()).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would otherwise be logged to stderr
+
+
+class Server(threading.Thread):
+    """
+    Serves the metrics from collect() on http://host:port/metrics from a background thread.
+    """
+
+    def __init__(self, collect, port, host='127.0.0.1'):
+        """
+        :param collect: Callable returning the metric families to render, see render().
+        """
+        threading.Thread.__init__(self)
+        self._server = HTTPServer((host, port), _Handler)
+        self._server.collect = collect
+        self.setDaemon(True)
+        self.start()
+
+    def run(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class Dumper(threading.Thread):
+    """
+    Rewrites a file with the metrics from collect() every interval seconds (of real time), for runs
+    nothing scrapes. The file is replaced atomically, so readers never see a partial dump.
+    """
+
+    def __init__(self, collect, path, interval=constants.Metrics.DUMP_INTERVAL):
+        threading.Thread.__init__(self)
+        self.collect = collect
+        self.path = path
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self.setDaemon(True)
+        self.start()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.dump()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.dump()  # Final values
+
+    def dump(self):
+        try:
+            with open(self.path + '.tmp', 'w') as f:
+                f.write(render(self.collect()))
+            os.rename(self.path + '.tmp', self.path)
+        except OSError as e:
+            print(e)
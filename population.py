@@ -0,0 +1,126 @@
+import socket
+import struct
+from array import array
+
+import constants
+import util
+
+
+def zipf_weights(n, s):
+    """
+    Relative frequencies of ranks 1..n under Zipf's law with exponent s.
+    """
+    return [1 / (k + 1) ** s for k in range(n)]
+
+
+class AliasTable:
+    """
+    Walker/Vose alias table: draws index i with probability weights[i] / sum(weights) in O(1), from a
+    single uniform random number.
+    """
+
+    def __init__(self, weights):
+        n = len(weights)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        self.n = n
+        self._probability = array('d', [1.0]) * n  # Chance of keeping the column rather than taking its alias
+        self._alias = array('L', range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self._probability[s] = scaled[s]
+            self._alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # Whatever is left is 1 up to rounding, so always keeps its own column
+
+    def sample(self, rng):
+        """
+        :param rng: random.Random stream to draw from.
+        """
+        u = rng.random() * self.n
+        i = int(u)
+        return i if u - i < self._probability[i] else self._alias[i]
+
+
+class Population:
+    """
+    A fixed set of users, each with a stable IP address, a preferred OAuth client and an authentication
+    adapter, drawn with Zipf-skewed popularity so that, like production, a few users and clients account
+    for most transactions while the long tail keeps cardinality high.
+
+    Users are kept as parallel arrays of indexes into the util.Mock name lists, with a serial number
+    telling apart users who share a name, rather than as strings. Strings are built when a user is
+    drawn, except for the Population.HOT_USERS most popular, whose names and addresses are built up
+    front as they make up most draws.
+    """
+
+    def __init__(self, size, rng, user_skew=constants.Population.USER_SKEW,
+                 client_skew=constants.Population.CLIENT_SKEW):
+        """
+        :param size: Number of users.
+        :param rng: random.Random stream to generate the users from. Users are ranked by popularity in
+                    the order they are generated.
+        """
+        self.size = size
+        self.users = AliasTable(zipf_weights(size, user_skew))
+        self.clients = AliasTable(zipf_weights(len(util.Mock.OAUTH_CLIENTS), client_skew))
+        self._first = array('B')
+        self._last = array('B')
+        self._domain = array('B')
+        self._serial = array('L')
+        self._ip = array('L')
+        self._client = array('B')
+        self._adapter = array('B')
+
+        serials = {}
+        first_names, last_names, domains = (len(util.Mock.FIRST_NAMES), len(util.Mock.LAST_NAMES),
+                                            len(util.Mock.EMAIL_DOMAINS))
+        adapters = len(util.Mock.ADAPTERS)
+        subnets = [(int(s.network_address), s.max_prefixlen - s.prefixlen) for s in util.Mock.SUBNETS]
+        random, getrandbits, sample_client = rng.random, rng.getrandbits, self.clients.sample
+        for n in range(size):
+            name = int(random() * first_names * last_names * domains)
+            serial = serials.get(name, 0)
+            serials[name] = serial + 1
+            name, domain = divmod(name, domains)
+            first, last = divmod(name, last_names)
+            self._first.append(first)
+            self._last.append(last)
+            self._domain.append(domain)
+            self._serial.append(serial)
+            address, bits = subnets[int(random() * len(subnets))]
+            self._ip.append(address + getrandbits(bits))
+            self._client.append(sample_client(rng))
+            self._adapter.append(int(random() * adapters))
+
+        hot = range(min(size, constants.Population.HOT_USERS))
+        self._hot_users = [self._user(i) for i in hot]
+        self._hot_ips = [self._ip_address(i) for i in hot]
+
+    def draw(self, rng):
+        """
+        Draw a user for a transaction.
+
+        :param rng: random.Random stream to draw from.
+        :return: (user, ip, client, adapter) fields for the transaction.
+        """
+        i = self.users.sample(rng)
+        if rng.random() < constants.Population.PREFERRED_CLIENT:
+            client = self._client[i]
+        else:
+            client = self.clients.sample(rng)
+        if i < len(self._hot_users):
+            user, ip = self._hot_users[i], self._hot_ips[i]
+        else:
+            user, ip = self._user(i), self._ip_address(i)
+        return user, ip, util.Mock.OAUTH_CLIENTS[client], util.Mock.ADAPTERS[self._adapter[i]]
+
+    def _user(self, i):
+        return '%s.%s%s@%s' % (util.Mock.FIRST_NAMES[self._first[i]], util.Mock.LAST_NAMES[self._last[i]],
+                               self._serial[i] or '', util.Mock.EMAIL_DOMAINS[self._domain[i]])
+
+    def _ip_address(self, i):
+        return socket.inet_ntoa(struct.pack('!L', self._ip[i]))
@@ -0,0 +1,155 @@
+import time
+from datetime import datetime
+from random import Random
+
+import clock
+import constants
+
+
+def usage_level(t):
+    """
+    Position on the daily usage curve at epoch time t, from 0 overnight to 1 at peak: ramping linearly
+    from KICKOFF_TIME up to PEAK_TIME, holding until DROPOFF_TIME, then dropping back to 0.
+    """
+    d = datetime.fromtimestamp(t)
+    hour = d.hour + d.minute / 60 + d.second / 3600
+    if hour < constants.Usage.KICKOFF_TIME or hour >= constants.Usage.DROPOFF_TIME:
+        return 0
+    if hour >= constants.Usage.PEAK_TIME:
+        return 1
+    return (hour - constants.Usage.KICKOFF_TIME) / (constants.Usage.PEAK_TIME - constants.Usage.KICKOFF_TIME)
+
+
+def usage_rate(t, base, peak):
+    """
+    Target events per second at epoch time t on the daily usage curve, from base overnight to peak.
+    """
+    return base + (peak - base) * usage_level(t)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate tokens per clock second, holding at most burst tokens.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._last = clock.now()
+
+    def refill(self):
+        now = clock.now()
+        self.tokens = min(self.tokens + (now - self._last) * self.rate, self.burst)
+        self._last = now
+
+    def take(self, n):
+        """
+        Take n tokens if the bucket holds them.
+
+        :return: True if the tokens were taken.
+        """
+        if self.tokens < n:
+            return False
+        self.tokens -= n
+        return True
+
+
+class RateController:
+    """
+    Paces transaction starts so the audit log receives a target number of events per second.
+
+    The controller runs as a flow on the scheduler. Every Rate.TICK seconds it sets the bucket's refill
+    rate to the target for the current (real or virtual) time and starts as many transactions as the
+    bucket pays for, spread evenly across the tick. A transaction costs the running mean of the events
+    completed transactions wrote.
+
+    If the audit writer's queue is more than half full (or past Rate.MAX_WRITER_BACKLOG if it is
+    unbounded) the writer is falling behind: on an
+    unpaced virtual clock generation waits for it to drain, otherwise the tick's starts are shed.
+    """
+
+    def __init__(self, scheduler, transaction, logger, eps, peak_eps=None, share=1, rng=None):
+        """
+        :param scheduler: Scheduler to run the controller and its transactions on.
+        :param transaction: Callable returning a flow for a single transaction, which returns the number
+                            of events it wrote.
+        :param logger: LogWriter the events are written to.
+        :param eps: Target events per second, or the overnight rate if peak_eps is set.
+        :param peak_eps: If set, follow the daily usage curve from eps up to peak_eps.
+        :param share: Fraction of the target this controller is responsible for, e.g. per shard.
+        :param rng: random.Random stream to jitter transaction starts with.
+        """
+        self.scheduler = scheduler
+        self.logger = logger
+        self.eps = eps
+        self.peak_eps = peak_eps
+        self.share = share
+        self.events_per_transaction = constants.Rate.EVENTS_PER_TRANSACTION
+        self.bucket = TokenBucket(self.target(), self.target() * constants.Rate.TICK)
+        self.started = 0
+        self.completed = 0
+        self.throttled = 0
+        self.max_backlog = logger.max_queue / 2 if logger.max_queue else constants.Rate.MAX_WRITER_BACKLOG
+        self.rng = rng if rng is not None else Random()
+        self._transaction = transaction
+        self._stopped = False
+
+    def target(self):
+        if self.peak_eps is None:
+            return self.eps * self.share
+        return usage_rate(clock.now(), self.eps, self.peak_eps) * self.share
+
+    def run(self):
+        last_report = clock.now()
+        last_records = self.logger.records
+        while not self._stopped:
+            self._tick()
+            yield constants.Rate.TICK
+
+            now = clock.now()
+            if now - last_report >= constants.Rate.REPORT_INTERVAL:
+                records = self.logger.records
+                self.report(self.target(), (records - last_records) / (now - last_report))
+                last_report, last_records = now, records
+
+    def stop(self):
+        self._stopped = True
+
+    def report(self, target, achieved):
+        print("Rate: target %.0f eps, achieved %.0f eps, %d transactions in flight, writer backlog %d, "
+              "throttled %d times" % (target, achieved, self.started - self.completed, self.logger.backlog(),
+                                      self.throttled))
+
+    def _tick(self):
+        rate = self.target()
+        self.bucket.rate = rate
+        # Room for a tick's worth on top of the change left over from the last, so none is lost to rounding
+        self.bucket.burst = rate * constants.Rate.TICK + self.events_per_transaction
+        self.bucket.refill()
+
+        if self.logger.backlog() > self.max_backlog:
+            self.throttled += 1
+            if isinstance(clock.CLOCK, clock.VirtualClock) and not clock.CLOCK.speed:
+                # Virtual time stands still while we wait, so no load is lost
+                while self.logger.backlog() > self.max_backlog / 2:
+                    time.sleep(0.01)
+            else:
+                self.bucket.tokens = 0
+                return
+
+        interval = self.events_per_transaction / rate if rate else 0
+        delay = self.rng.random() * interval  # Don't start every controller's transactions on the same instant
+        while self.bucket.take(self.events_per_transaction):
+            self.scheduler.spawn(self._run_transaction(), delay)
+            self.started += 1
+            delay += interval
+
+    def _run_transaction(self):
+        try:
+            events = yield from self._transaction()
+            # Exponential moving average of the events per transaction
+            self.events_per_transaction += (events - self.events_per_transaction) * 0.01
+        except Exception as e:
+            print(e)
+        self.completed += 1
@@ -0,0 +1,151 @@
+import glob
+import gzip
+import io
+import mmap
+import os
+import re
+from datetime import datetime
+
+import clock
+import constants
+import util
+
+TIMESTAMP_SIZE = len('2018-09-18 05:30:15,666')  # Every generated line starts with one, see util.Timestamp
+
+
+class LogReader:
+    """
+    Reads back a log as written by the generators, oldest line first: its rotated generations (path.N ...
+    path.1) followed by path itself, or the same under path.gz or path.zst for logs written by compressing
+    sinks. Uncompressed files are mapped rather than read, so lines are sliced straight out of the page
+    cache; gzip and zstd compressed ones (zstd needs the zstandard package) are streamed through a
+    decompressor.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        files = []
+        for base, suffix in ((path, ''), (path + '.gz', '.gz'), (path + '.zst', '.zst')):
+            for name in glob.glob(glob.escape(base) + '.*'):
+                match = re.match(re.escape(base) + r'\.(\d+)(\.gz|\.zst)?$', name)
+                if match is not None:
+                    files.append((int(match.group(1)), name, suffix or match.group(2) or ''))
+            if os.path.exists(base):
+                files.append((0, base, suffix))
+        # (path, compression suffix) of each file, oldest first
+        self.files = [(name, suffix) for n, name, suffix in sorted(files, reverse=True)]
+        # (second, epoch time) of the last timestamp parsed, as consecutive lines mostly share a second
+        self._cache = (None, None)
+
+    def __iter__(self):
+        """
+        Yield (time, line) for each line, where time is the epoch time of the line's timestamp or None if
+        it doesn't start with one.
+        """
+        for path, suffix in self.files:
+            for line in self._lines(path, suffix):
+                if line[:1] == b'\0':
+                    break  # Unused tail of a preallocated file, see sinks.PreallocatedFileSink
+                yield self._time(line), line
+
+    @staticmethod
+    def _lines(path, suffix):
+        with open(path, 'rb') as f:
+            if suffix == '.gz':
+                with gzip.open(f) as lines:
+                    yield from lines
+            elif suffix == '.zst':
+                import zstandard  # Only needed for zstd logs
+                # Compressing sinks start a new frame each time they reopen the file
+                reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+                with io.BufferedReader(reader) as lines:
+                    yield from lines
+            elif os.fstat(f.fileno()).st_size:  # Empty files can't be mapped
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    yield from iter(m.readline, b'')
+
+    def _time(self, line):
+        second, millis = line[:19], line[20:TIMESTAMP_SIZE]
+        if line[19:20] != b',' or not millis.isdigit():
+            return None
+        cached, epoch = self._cache
+        if second != cached:
+            try:
+                epoch = datetime.strptime(second.decode(), '%Y-%m-%d %H:%M:%S').timestamp()
+            except (ValueError, UnicodeDecodeError):
+                return None
+            self._cache = (second, epoch)
+        return epoch + int(millis) / 1000
+
+
+class Replay:
+    """
+    Re-emits previously generated logs through LogWriters instead of generating new ones.
+
+    Each log is replayed by its own flow, which writes the lines whose shifted timestamps have come due
+    in one batch per step, at most Replay.BATCH_INTERVAL seconds late. Timestamps are shifted so the
+    earliest line of any of the logs lands on origin, keeping the logs aligned with one another, and
+    compressed rate times over so the replay runs rate times faster. Lines without a timestamp are
+    passed through with the line before them.
+    """
+
+    def __init__(self, directory, origin, rate=1):
+        """
+        :param directory: Directory holding the logs to replay, named as in constants.Logs.
+        :param origin: Epoch time the replayed logs start at.
+        :param rate: Speed-up of the replay; timestamps are compressed to match.
+        """
+        self.directory = directory
+        self.origin = origin
+        self.rate = rate
+        self._lines = {}  # Line iterator of each log, with the first line already taken off
+        firsts = []
+        for log in constants.Logs.ALL:
+            lines = iter(LogReader(os.path.join(directory, os.path.basename(log))))
+            first = next(lines, None)
+            if first is None:
+                continue
+            self._lines[log] = (first, lines)
+            firsts.append(first[0])
+        times = [t for t in firsts if t is not None]
+        self.start = min(times) if times else origin
+
+    def logs(self):
+        return list(self._lines)
+
+    def shift(self, t):
+        return self.origin + (t - self.start) / self.rate
+
+    def flow(self, log, logger, done=None):
+        """
+        Flow replaying a log to logger.
+
+        :param done: Called once the whole log has been written.
+        """
+        (t, line), lines = self._lines.pop(log)
+        stamp = util.Timestamp()
+        print("Replaying %s" % os.path.join(self.directory, os.path.basename(log)))
+        try:
+            while line is not None:
+                horizon = clock.now()
+                batch = []
+                while line is not None and len(batch) < constants.Replay.MAX_BATCH:
+                    if t is None:
+                        batch.append(line.decode(errors='replace'))
+                    else:
+                        shifted = self.shift(t)
+                        if shifted > horizon:
+                            break
+                        batch.append(stamp(shifted) + line[TIMESTAMP_SIZE:].decode(errors='replace'))
+                    t, line = next(lines, (None, None))
+                if batch:
+                    logger.write(''.join(batch), len(batch))
+                if line is None:
+                    break
+                if len(batch) >= constants.Replay.MAX_BATCH:
+                    yield 0
+                else:
+                    yield max(self.shift(t) - clock.now(), constants.Replay.BATCH_INTERVAL)
+        finally:
+            if done is not None:
+                done(log)
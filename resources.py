@@ -0,0 +1,79 @@
+import math
+
+import constants
+import util
+from cache import SlidingWindowCounter
+
+
+def sum_uniform(n, scale, rng):
+    """
+    Sample the sum of n uniform(0, scale) draws from rng in O(1).
+
+    Small sums are drawn exactly; larger ones from the normal approximation of the Irwin-Hall
+    distribution, clipped to its support.
+    """
+    if n <= 12:
+        return sum(rng.random() for _ in range(n)) * scale
+    return min(max(rng.gauss(n / 2, math.sqrt(n / 12)), 0), n) * scale
+
+
+def sum_randint(n, high, rng):
+    """
+    Sample the sum of n draws of ceil(uniform(0, high)), i.e. integers uniform over 1..high, from rng in O(1).
+    """
+    if n <= 12:
+        return sum(math.ceil(rng.random() * high) for _ in range(n))
+    total = rng.gauss(n * (high + 1) / 2, math.sqrt(n * (high ** 2 - 1) / 12))
+    return int(min(max(round(total), n), n * high))
+
+
+class HostResources:
+    """
+    Resource usage model for a single mock host.
+
+    Load is driven by the number of transactions the host has completed recently: each transaction
+    updates the model incrementally and resamples the aggregate CPU and memory load for the current
+    transaction count from its distribution rather than summing one draw per recent transaction.
+
+    Draws come from the host's own random stream, see util.rng. Like the flows driving it, the model is
+    only updated from the scheduler thread, so it needs no lock; shard workers each own their hosts'.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.rng = util.rng('host', host)
+        self.recent_transactions = SlidingWindowCounter(constants.OAuth.TXN_CACHE_TTL,
+                                                        constants.OAuth.TXN_CACHE_RESOLUTION)
+        self.cpu = self.rng.randint(constants.Cpu.MIN_BASE_USAGE, constants.Cpu.MAX_BASE_USAGE)
+        self.memory = self.rng.randint(constants.Memory.MIN_BASE_USAGE, constants.Memory.MAX_BASE_USAGE)
+        self.disk = self.rng.randint(constants.Disk.MIN_BASE_USAGE, constants.Disk.MAX_BASE_USAGE)
+
+    def transaction(self):
+        """
+        Account for a completed transaction on the host.
+        """
+        # TODO: have a timed decrease in disk usage (rollover archiving, cold storage, periodic removal etc.)
+        # TODO: simulate CPU/Memory flapping?
+        recent_tx_count = self.recent_transactions.add()
+        self.disk = min(self.disk + constants.Disk.USAGE_INCREMENT_PER_TRANSACTION, 100)
+        # TODO: generate disk usage errors in server.log once the disk is full
+        # wobble the base values and add load based on transactions in the last n minutes
+        self.cpu = min(self.rng.randint(constants.Cpu.MIN_BASE_USAGE, constants.Cpu.MAX_BASE_USAGE)
+                       + sum_uniform(recent_tx_count, constants.Cpu.MAX_USAGE_PER_TRANSACTION, self.rng), 100)
+        self.memory = (self.rng.randint(constants.Memory.MIN_BASE_USAGE, constants.Memory.MAX_BASE_USAGE)
+                       + sum_randint(recent_tx_count, constants.Memory.MAX_USAGE_PER_TRANSACTION, self.rng))
+        if self.memory > constants.Memory.DEFAULT_TOTAL * constants.Memory.MAX_USED:
+            # Saturated: stay below the cap rather than pinned to it, like a host under memory pressure
+            self.memory = round(constants.Memory.DEFAULT_TOTAL * (
+                constants.Memory.MAX_USED - self.rng.random() * constants.Memory.SATURATION_SPREAD))
+
+    def cleanup_disk(self):
+        self.disk = self.rng.randint(constants.Disk.MIN_BASE_USAGE, constants.Disk.MAX_BASE_USAGE)
+
+    def processes(self):
+        return (self.rng.randint(constants.Memory.MIN_PROCESSES, constants.Memory.MAX_PROCESSES)
+                + self.recent_transactions.count())
+
+    def threads(self):
+        return (self.rng.randint(constants.Memory.MIN_THREADS, constants.Memory.MAX_THREADS)
+                + self.recent_transactions.count() * 2)
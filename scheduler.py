@@ -0,0 +1,191 @@
+import asyncio
+import heapq
+import itertools
+import threading
+
+import clock
+
+
+class Scheduler(threading.Thread):
+    """
+    Single-threaded discrete-event scheduler.
+
+    Pending work is kept in a heap of (due time, callback) entries and run in order on one thread.
+    Flows are generators which yield the number of seconds until their next step, so a simulated
+    transaction only costs a heap entry and a suspended generator frame rather than an OS thread.
+
+    Due times are read from clock.CLOCK, so the same flows run in real time or against a virtual
+    clock. If until is set the scheduler exits once no pending entry is due by then.
+    """
+
+    def __init__(self, until=None):
+        threading.Thread.__init__(self)
+        self.until = until
+        self._heap = []
+        self._sequence = itertools.count()  # Tie-breaker so equal due times never compare callbacks
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self.setDaemon(True)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            with self._condition:
+                if not self._heap:
+                    if self.until is not None:
+                        return  # Nothing left to run before the end time
+                    self._condition.wait()
+                    continue
+                entry = self._heap[0]
+                if entry[2] is None:  # Cancelled
+                    heapq.heappop(self._heap)
+                    continue
+                if self.until is not None and entry[0] > self.until:
+                    return
+                if entry[0] > clock.now():
+                    clock.CLOCK.wait(self._condition, entry[0])
+                    continue
+                heapq.heappop(self._heap)
+            due, _, fn, args = entry
+            if fn is None:
+                continue
+            try:
+                fn(*args)
+            except Exception as e:
+                print(e)
+
+    def stop(self):
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify()
+
+    def call_later(self, delay, fn, *args):
+        """
+        Run fn(*args) on the scheduler thread after delay seconds.
+
+        :return: Handle which can be passed to cancel().
+        """
+        entry = [clock.now() + delay, next(self._sequence), fn, args]
+        with self._condition:
+            heapq.heappush(self._heap, entry)
+            self._condition.notify()
+        return entry
+
+    def cancel(self, entry):
+        entry[2] = None  # Dropped lazily when it reaches the top of the heap
+
+    def spawn(self, flow, delay=0):
+        """
+        Start driving a flow.
+
+        :param flow: Generator yielding the number of seconds to wait before resuming it.
+        :param delay: Seconds to wait before the first step. Defaults to 0.
+        """
+        self.call_later(delay, self._step, flow)
+
+    def pending(self):
+        with self._condition:
+            return len(self._heap)
+
+    def _step(self, flow):
+        try:
+            delay = next(flow)
+        except StopIteration:
+            return
+        self.call_later(delay, self._step, flow)
+
+
+class AsyncioScheduler(threading.Thread):
+    """
+    The Scheduler interface on an asyncio event loop, run on its own thread.
+
+    Each flow is driven by a coroutine awaiting its delays, and callbacks (such as events timers) are
+    scheduled on the loop. Delays are in clock seconds, scaled to real time for a paced virtual clock.
+    Entries are handed to the loop thread-safely, so they can be scheduled from any thread, before or
+    after start(). An unpaced virtual clock isn't supported, as the loop keeps real time.
+    """
+
+    def __init__(self, until=None):
+        threading.Thread.__init__(self)
+        if isinstance(clock.CLOCK, clock.VirtualClock) and not clock.CLOCK.speed:
+            raise ValueError('the asyncio runtime needs real time or a paced virtual clock')
+        self.until = until
+        self.loop = asyncio.new_event_loop()
+        self._tasks = set()
+        self._callbacks = 0
+        self.setDaemon(True)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        if self.until is not None:
+            self.call_later(self.until - clock.now(), self.loop.stop)
+        try:
+            self.loop.run_forever()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            if self._tasks:
+                self.loop.run_until_complete(asyncio.gather(*self._tasks, return_exceptions=True))
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def call_later(self, delay, fn, *args):
+        """
+        Run fn(*args) on the loop after delay seconds.
+
+        :return: Handle which can be passed to cancel().
+        """
+        entry = [clock.now() + delay, fn, args]
+        self._callbacks += 1
+        self.loop.call_soon_threadsafe(self._call_at, entry)
+        return entry
+
+    def cancel(self, entry):
+        entry[1] = None  # Dropped when it comes due, as the loop may be running on another thread
+
+    def spawn(self, flow, delay=0):
+        """
+        Start driving a flow.
+
+        :param flow: Generator yielding the number of seconds to wait before resuming it.
+        :param delay: Seconds to wait before the first step. Defaults to 0.
+        """
+        self.call_later(delay, self._start, flow)
+
+    def pending(self):
+        return self._callbacks + len(self._tasks)
+
+    def _call_at(self, entry):
+        self.loop.call_later(self._real(entry[0] - clock.now()), self._run, entry)
+
+    def _run(self, entry):
+        self._callbacks -= 1
+        due, fn, args = entry
+        if fn is None:
+            return
+        try:
+            fn(*args)
+        except Exception as e:
+            print(e)
+
+    def _start(self, flow):
+        task = self.loop.create_task(self._drive(flow))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drive(self, flow):
+        try:
+            for delay in flow:
+                await asyncio.sleep(self._real(delay))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(e)
+
+    @staticmethod
+    def _real(delay):
+        """
+        Real seconds to wait for delay clock seconds.
+        """
+        speed = getattr(clock.CLOCK, 'speed', 1)
+        return max(delay / speed, 0)
@@ -0,0 +1,75 @@
+import multiprocessing
+import os
+
+import clock
+
+
+def shard_log(log, index):
+    """
+    Path of a shard's own copy of a log, e.g. /var/log/mock/shard0/audit.log
+    """
+    path = os.path.join(os.path.dirname(log), 'shard%d' % index)
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, os.path.basename(log))
+
+
+class Coordinator:
+    """
+    Runs generation in worker processes, each owning a partition of the hosts.
+
+    The coordinator stays in charge of load: commands such as spawning flows are split across the
+    workers and stamped with the coordinator's clock time so every worker applies them at the same
+    point on its own clock. Commands sent before start() are handed to the workers up front, which
+    lets the coordinator plan an entire accelerated run before any worker begins.
+    """
+
+    def __init__(self, shards, target):
+        """
+        :param shards: Number of worker processes.
+        :param target: Worker entry point, called as target(index, hosts, commands, backlog) where
+                       commands is a queue of live commands ending with None and backlog is a list
+                       of commands sent before the workers started.
+        """
+        # Fork so workers inherit the configured clock, constants and module state
+        self._context = multiprocessing.get_context('fork')
+        self.shards = shards
+        self._target = target
+        self._queues = [self._context.Queue() for n in range(shards)]
+        self._backlog = [[] for n in range(shards)]
+        self._processes = []
+        self._next = 0
+
+    def start(self, hosts):
+        for n in range(self.shards):
+            p = self._context.Process(target=self._target,
+                                      args=(n, hosts[n::self.shards], self._queues[n], self._backlog[n]),
+                                      name='shard%d' % n)
+            p.start()
+            self._processes.append(p)
+
+    def send(self, action, count, *args):
+        """
+        Split count between the workers and send each its share of the command.
+        """
+        share, remainder = divmod(count, self.shards)
+        for n in range(self.shards):
+            # Rotate which workers receive the remainder so small commands spread evenly
+            shard = (self._next + n) % self.shards
+            c = share + (1 if n < remainder else 0)
+            if c > 0:
+                command = (clock.now(), action, c) + args
+                if self._processes:
+                    self._queues[shard].put(command)
+                else:
+                    self._backlog[shard].append(command)
+        self._next = (self._next + remainder) % self.shards
+
+    def stop(self):
+        """
+        Tell the workers no more commands are coming and wait for them to finish.
+        """
+        for q in self._queues:
+            q.put(None)
+        for p in self._processes:
+            p.join()
+            print("Stopped %s (exit code %s)" % (p.name, p.exitcode))
@@ -0,0 +1,587 @@
+import contextlib
+import fcntl
+import gzip
+import mmap
+import os
+import queue
+import shutil
+import socket
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+# (max bytes, 'hourly', 'daily' or None, generations kept, compress rotated files), see FileSink
+DEFAULT_ROTATION = (100 * 1024 ** 2, None, 1, False)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'  # Leading second of every generated line, see util.Timestamp
+TIMESTAMP_SIZE = len('2018-09-18 05:30:15')
+
+
+class Sink:
+    """
+    Destination for the records of a LogWriter.
+
+    open() and close() are called on the writer's thread, and write() is given batches of whole records
+    already encoded as bytes.
+    """
+
+    rotations = 0  # Times the destination has been rotated, for sinks which rotate
+
+    def open(self):
+        pass
+
+    def write(self, data):
+        """
+        :return: Number of bytes written.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def compress(src, path):
+    """
+    Gzip the open file src to path, via a temporary name so a half-written file is never taken for a
+    generation.
+    """
+    with gzip.open(path + '.tmp', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.rename(path + '.tmp', path)
+
+
+class Worker(threading.Thread):
+    """
+    Runs jobs such as compressing rotated logs in the background, off the writer thread.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self._queue = queue.Queue()
+        self.setDaemon(True)
+        self.start()
+
+    def run(self):
+        while True:
+            fn = self._queue.get()
+            try:
+                fn()
+            except OSError as e:
+                print(e)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, fn):
+        self._queue.put(fn)
+
+    def wait(self):
+        """
+        Block until every submitted job has run.
+        """
+        self._queue.join()
+
+
+class FileSink(Sink):
+    """
+    Appends to a file, rotating it logrotate style once it grows past max_size bytes or, if an interval
+    is set, at the first record stamped in a new hour or day, so each file holds the records of one
+    interval however far the generator's clock has run ahead of the writer. Records without a leading
+    timestamp stay in the file of the record before them. The log is renamed to log.1 and a new one
+    created in its place, so tailers following the name pick it up; older generations move up one,
+    keeping at most generations of them. With compress set, generations from log.2 on are gzipped
+    on a background thread (like logrotate's delaycompress, log.1 stays as it is for tailers which
+    are still reading it).
+
+    If shared is set several processes append to the file at once: each write is a single O_APPEND
+    write, the size is read back from the file, and rotation and compression are serialized between
+    the processes with flock on log.lock.
+    """
+
+    def __init__(self, path, shared=False, rotation=None):
+        """
+        :param rotation: (max bytes, 'hourly', 'daily' or None, generations kept, compress rotated files),
+                         defaults to DEFAULT_ROTATION.
+        """
+        self.path = path
+        self.shared = shared
+        self.max_size, self.interval, self.generations, self.compress = rotation or DEFAULT_ROTATION
+        if self.interval not in (None, 'hourly', 'daily'):
+            raise ValueError("unknown rotation interval '%s'" % self.interval)
+        self._file = None
+        self._size = 0
+        self._next_rotation = None  # Epoch time of the next interval boundary, once a record has been seen
+        self._lock = threading.Lock()  # Held while moving generations
+        self._worker = None
+
+    def open(self):
+        self._file = self._open()
+        self._size = os.fstat(self._file.fileno()).st_size
+
+    def write(self, data):
+        written = len(data)
+        if self.interval is not None:
+            if self._next_rotation is None:
+                self._start_intervals(data)
+            # A batch may hold records from either side of one or more boundaries
+            split = self._boundary_offset(data)
+            while split is not None:
+                if split:
+                    self._size = self._append(data[:split])
+                    data = data[split:]
+                if self._size:
+                    self._rotate()
+                self._next_rotation = self._next_boundary(self._next_rotation)
+                split = self._boundary_offset(data)
+        self._size = self._append(data)
+        if self._size > self.max_size:
+            self._rotate()
+        return written
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._worker is not None:
+            self._worker.wait()
+
+    def generation(self, n):
+        """
+        Path of the nth rotated generation of the log.
+        """
+        if self.compress and n > 1:
+            return '%s.%d.gz' % (self.path, n)
+        return '%s.%d' % (self.path, n)
+
+    def _open(self):
+        return open(self.path, 'ab', buffering=0)
+
+    def _append(self, data):
+        """
+        :return: Size of the file after writing data.
+        """
+        self._file.write(data)
+        if self.shared:
+            return os.fstat(self._file.fileno()).st_size
+        return self._size + len(data)
+
+    def _start_intervals(self, data):
+        """
+        Set the first boundary to the one after the first timestamped record in data, if there is one.
+        """
+        start = 0
+        while start < len(data):
+            stamp = data[start:start + TIMESTAMP_SIZE]
+            if _is_stamp(stamp):
+                t = datetime.strptime(stamp.decode(), TIMESTAMP_FORMAT).timestamp()
+                self._next_rotation = self._next_boundary(t)
+                return
+            start = data.find(b'\n', start) + 1 or len(data)
+
+    def _boundary_offset(self, data):
+        """
+        :return: Offset of the first record in data stamped at or after the next boundary, or None if
+                 there is none.
+        """
+        if self._next_rotation is None:
+            return None
+        boundary = datetime.fromtimestamp(self._next_rotation).strftime(TIMESTAMP_FORMAT).encode()
+        # Records are stamped in order, so most batches end before the boundary
+        last = data.rfind(b'\n', 0, len(data) - 1) + 1
+        stamp = data[last:last + TIMESTAMP_SIZE]
+        if _is_stamp(stamp) and stamp < boundary:
+            return None
+        start = 0
+        while start < len(data):
+            stamp = data[start:start + TIMESTAMP_SIZE]
+            if _is_stamp(stamp) and stamp >= boundary:
+                return start
+            start = data.find(b'\n', start) + 1 or len(data)
+        return None
+
+    def _next_boundary(self, t):
+        """
+        Start of the hour or day after the one holding epoch time t.
+        """
+        d = datetime.fromtimestamp(t)
+        if self.interval == 'hourly':
+            return (d.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)).timestamp()
+        return (d.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)).timestamp()
+
+    @contextlib.contextmanager
+    def _generations_lock(self):
+        with self._lock:
+            if not self.shared:
+                yield
+                return
+            with open(self.path + '.lock', 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                yield
+
+    def _rotate(self):
+        with self._generations_lock():
+            # Another process may have rotated the file while we waited for the lock
+            if not self.shared or self._is_current():
+                self._shift()
+                self.rotations += 1
+        self._file.close()
+        self.open()
+
+    def _shift(self):
+        """
+        Move each generation up one, dropping the oldest, and the log to generation 1.
+
+        Generations from 2 on may still be waiting for the worker to compress them, so each is moved under
+        whichever name it has. Nothing is compressed here, on the writer thread.
+        """
+        for name in ('%s.%d' % (self.path, self.generations), self.generation(self.generations)):
+            if os.path.exists(name):
+                os.remove(name)
+        for n in range(self.generations - 1, 0, -1):
+            for name, moved in (('%s.%d' % (self.path, n), '%s.%d' % (self.path, n + 1)),
+                                (self.generation(n), self.generation(n + 1))):
+                if os.path.exists(name):
+                    os.rename(name, moved)
+        os.rename(self.path, self.generation(1))
+        if self.compress and os.path.exists('%s.2' % self.path):
+            if self._worker is None:
+                self._worker = Worker()
+            self._worker.submit(self._compress_pending)
+
+    def _compress_pending(self):
+        """
+        Gzip every generation from 2 on which isn't compressed yet, oldest first.
+
+        Rotations carry on meanwhile: the lock is only held to open a generation and then to swap in its
+        compressed copy, which goes wherever the generation has moved to by then, found by its inode. If it
+        has been dropped as the oldest, or compressed by another process, the copy is discarded.
+        """
+        while True:
+            with self._generations_lock():
+                pending = [n for n in range(2, self.generations + 1) if os.path.exists('%s.%d' % (self.path, n))]
+                if not pending:
+                    return
+                src = open('%s.%d' % (self.path, pending[-1]), 'rb')
+            copy = '%s.%d.gz.pending' % (self.path, os.getpid())
+            with src:
+                inode = os.fstat(src.fileno()).st_ino
+                compress(src, copy)
+            with self._generations_lock():
+                for n in range(2, self.generations + 1):
+                    name = '%s.%d' % (self.path, n)
+                    try:
+                        if os.stat(name).st_ino != inode:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    os.rename(copy, self.generation(n))
+                    os.remove(name)
+                    break
+                else:
+                    os.remove(copy)
+
+    def _is_current(self):
+        try:
+            return os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+
+def _is_stamp(stamp):
+    return len(stamp) == TIMESTAMP_SIZE and stamp[4:5] == b'-' and stamp[10:11] == b' ' and stamp[:4].isdigit()
+
+
+class GzipFileSink(FileSink):
+    """
+    Appends to a gzip compressed file, flushing the compressor after each batch so the file can be read
+    while it is written. Rotates on the compressed size.
+    """
+
+    def __init__(self, path, shared=False, rotation=None):
+        if shared:
+            raise ValueError("compressed logs can't be appended to by several processes")
+        max_size, interval, generations, compress = rotation or DEFAULT_ROTATION
+        FileSink.__init__(self, path + '.gz', rotation=(max_size, interval, generations, False))
+
+    def _append(self, data):
+        self._file.write(data)
+        self._file.flush()
+        return self._file.fileobj.tell()
+
+    def _open(self):
+        return gzip.open(self.path, 'ab')
+
+
+class ZstdFileSink(FileSink):
+    """
+    Appends to a zstd compressed file, ending a block after each batch. Rotates on the compressed size.
+    """
+
+    def __init__(self, path, shared=False, rotation=None, level=3):
+        import zstandard  # Only needed for zstd sinks
+        if shared:
+            raise ValueError("compressed logs can't be appended to by several processes")
+        max_size, interval, generations, compress = rotation or DEFAULT_ROTATION
+        FileSink.__init__(self, path + '.zst', rotation=(max_size, interval, generations, False))
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._flush_block = zstandard.FLUSH_BLOCK
+        self._raw = None
+
+    def _append(self, data):
+        self._file.write(data)
+        self._file.flush(self._flush_block)
+        return self._raw.tell()
+
+    def _open(self):
+        self._raw = open(self.path, 'ab')
+        return self._compressor.stream_writer(self._raw)
+
+
+class _PreallocatedFile:
+    """
+    A log file preallocated to capacity bytes, written at an explicit offset with pwritev. Batches are
+    gathered until gather_size bytes are pending and then written with a single call; the preallocated
+    space past the data is truncated away on close.
+    """
+
+    gather_size = 1024 * 1024
+
+    def __init__(self, path, capacity):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.size = self._data_end()
+        self._pending = []
+        self._pending_size = 0
+        self._offset = self.size
+        self._allocate(max(capacity, self.size))
+
+    def fileno(self):
+        return self._fd
+
+    def write(self, data):
+        self._pending.append(data)
+        self._pending_size += len(data)
+        self.size += len(data)
+        if self._pending_size >= self.gather_size:
+            self._write_pending()
+
+    def close(self):
+        self._write_pending()
+        os.ftruncate(self._fd, self.size)
+        os.close(self._fd)
+
+    def _allocate(self, capacity):
+        try:
+            os.posix_fallocate(self._fd, 0, capacity)
+        except (AttributeError, OSError):
+            os.ftruncate(self._fd, capacity)  # Sparse, for platforms and filesystems without fallocate
+        self.capacity = capacity
+
+    def _write_pending(self):
+        if self._pending:
+            if hasattr(os, 'pwritev'):
+                self._offset += os.pwritev(self._fd, self._pending, self._offset)
+            else:  # Python < 3.7
+                self._offset += os.pwrite(self._fd, b''.join(self._pending), self._offset)
+            self._pending = []
+            self._pending_size = 0
+
+    def _data_end(self):
+        """
+        End of the data in an existing file, skipping preallocated space left by an unclean shutdown.
+        """
+        end = os.fstat(self._fd).st_size
+        while end > 0:
+            start = max(end - 64 * 1024, 0)
+            data = os.pread(self._fd, end - start, start).rstrip(b'\0')
+            if data:
+                return start + len(data)
+            end = start
+        return 0
+
+
+class _MappedFile(_PreallocatedFile):
+    """
+    A log file preallocated to capacity bytes and written by copying into a shared memory map of it.
+    """
+
+    def __init__(self, path, capacity):
+        self._mmap = None
+        _PreallocatedFile.__init__(self, path, capacity)
+
+    def write(self, data):
+        end = self.size + len(data)
+        if end > self.capacity:
+            self._mmap.close()
+            self._allocate(max(end, self.capacity * 2))
+        self._mmap[self.size:end] = data
+        self.size = end
+
+    def close(self):
+        self._mmap.close()
+        _PreallocatedFile.close(self)
+
+    def _allocate(self, capacity):
+        _PreallocatedFile._allocate(self, capacity)
+        self._mmap = mmap.mmap(self._fd, capacity)
+
+
+class PreallocatedFileSink(FileSink):
+    """
+    Appends to a log file preallocated to its rotation size, for maximum write throughput. Batches are
+    gathered into large writes and the file rotates exactly when the next batch would pass the
+    preallocated space. Readers see the file at its preallocated size, padded with zeros, until it is
+    rotated or closed, so this suits throughput benchmarks rather than tailers.
+    """
+
+    def __init__(self, path, shared=False, rotation=None):
+        if shared:
+            raise ValueError("preallocated logs can't be appended to by several processes")
+        FileSink.__init__(self, path, rotation=rotation)
+
+    def open(self):
+        self._file = self._open()
+        self._size = self._file.size
+
+    def write(self, data):
+        if self._size and self._size + len(data) > self.max_size:
+            self._rotate()
+        return FileSink.write(self, data)
+
+    def _open(self):
+        return _PreallocatedFile(self.path, self.max_size)
+
+    def _append(self, data):
+        self._file.write(data)
+        return self._file.size
+
+
+class MmapFileSink(PreallocatedFileSink):
+    """
+    Like PreallocatedFileSink, but written through a memory map of the preallocated file, leaving the
+    kernel to write dirty pages back.
+    """
+
+    def _open(self):
+        return _MappedFile(self.path, self.max_size)
+
+
+class StdoutSink(Sink):
+
+    def write(self, data):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+        return len(data)
+
+
+class _SocketSink(Sink):
+    """
+    Base for sinks sending to a socket. The connection is made once and reused; if a send fails the batch
+    is dropped and the connection is remade for the next one, so a collector restart doesn't stop the writer.
+    """
+
+    def __init__(self, family, kind, address):
+        self.family = family
+        self.kind = kind
+        self.address = address
+        self._socket = None
+
+    def write(self, data):
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(self.family, self.kind)
+                self._socket.connect(self.address)
+            return self._send(data)
+        except OSError as e:
+            print("Failed to send to %s: %s" % (self.address, e))
+            self.close()
+            return 0
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _send(self, data):
+        self._socket.sendall(data)
+        return len(data)
+
+
+class SyslogSink(_SocketSink):
+    """
+    Sends each line as an RFC 5424 syslog message, over UDP with one message per datagram (RFC 5426) or
+    over TCP with octet-counting framing (RFC 6587), where a batch goes out in a single send.
+    """
+
+    facility = 16  # local0
+    severity = 6  # informational
+
+    def __init__(self, host, port, app_name, tcp=False):
+        _SocketSink.__init__(self, socket.AF_INET, socket.SOCK_STREAM if tcp else socket.SOCK_DGRAM, (host, port))
+        self.tcp = tcp
+        # Everything ahead of the timestamp and after it up to the message is the same for every line
+        self._pri = ('<%d>1 ' % (self.facility * 8 + self.severity)).encode()
+        self._header = (' %s %s %d - - ' % (socket.gethostname(), app_name, os.getpid())).encode()
+
+    def _send(self, data):
+        header = self._pri + datetime.now(timezone.utc).isoformat().encode() + self._header
+        messages = [header + line.rstrip(b'\r') for line in data.split(b'\n') if line]
+        if self.tcp:
+            self._socket.sendall(b''.join(b'%d %s' % (len(m), m) for m in messages))
+        else:
+            for m in messages:
+                self._socket.send(m)
+        return len(data)
+
+
+class UnixSocketSink(_SocketSink):
+    """
+    Sends lines to a Unix domain socket, streamed as they are written or one line per datagram.
+    """
+
+    def __init__(self, path, datagram=False):
+        _SocketSink.__init__(self, socket.AF_UNIX, socket.SOCK_DGRAM if datagram else socket.SOCK_STREAM, path)
+        self.datagram = datagram
+
+    def _send(self, data):
+        if self.datagram:
+            for line in data.splitlines(keepends=True):
+                self._socket.send(line)
+        else:
+            self._socket.sendall(data)
+        return len(data)
+
+
+def from_spec(spec, path, shared=False, rotation=None):
+    """
+    Build a sink from its spec in constants.Logs.SINKS:
+
+        file, gzip, zstd     the log file at path, optionally compressed
+        prealloc, mmap       the log file at path, preallocated and written with pwritev or a memory map
+        stdout
+        udp://host:port      RFC 5424 syslog (port defaults to 514)
+        tcp://host:port      RFC 5424 syslog with octet counting (port defaults to 601)
+        unix:///path         Unix domain stream socket
+        unixgram:///path     Unix domain datagram socket
+
+    :param path: Log file path, which also names the syslog app, e.g. audit for audit.log
+    :param shared: Whether other processes append to the same file.
+    :param rotation: Rotation policy for file sinks, see FileSink.
+    """
+    if spec == 'file':
+        return FileSink(path, shared, rotation)
+    if spec == 'gzip':
+        return GzipFileSink(path, shared, rotation)
+    if spec == 'zstd':
+        return ZstdFileSink(path, shared, rotation)
+    if spec == 'prealloc':
+        return PreallocatedFileSink(path, shared, rotation)
+    if spec == 'mmap':
+        return MmapFileSink(path, shared, rotation)
+    if spec == 'stdout':
+        return StdoutSink()
+    url = urlsplit(spec)
+    if url.scheme in ('udp', 'tcp'):
+        tcp = url.scheme == 'tcp'
+        app_name = os.path.splitext(os.path.basename(path))[0]
+        return SyslogSink(url.hostname, url.port or (601 if tcp else 514), app_name, tcp)
+    if url.scheme in ('unix', 'unixgram'):
+        return UnixSocketSink(url.path, url.scheme == 'unixgram')
+    raise ValueError("unknown sink '%s'" % spec)
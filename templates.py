@@ -0,0 +1,110 @@
+import constants
+
+# Audit lines are built from one template per step of an OAuth transaction. The static fields of each step
+# are filled in once here, leaving positional str.format slots for the fields which change per transaction:
+# {0} timestamp, {1} tid, {2} user, {3} ip, {4} client, {5} host, {6} adapter, {7} response time, {8} description
+# Each template is stored as its bound format method, so writing a line is a single call:
+# AUTHN_START(timestamp, tid, user, ip, client, host, adapter_id, response_time, description)
+
+
+def audit_template(
+        role=constants.Roles.AS,
+        event=constants.Events.OAUTH,
+        user='{2}',
+        client='{4}',
+        protocol=constants.Protocols.OAUTH2,
+        grant_type='',
+        status=constants.Statuses.SUCCESS,
+        adapter_id='{6}',
+        description='{8}'):
+    # timestamp| tid| event| user| ip| | client| protocol| grant type| host| role| status| adapter| description| ms
+    return ("{0}| tid:{1}| %s| %s| {3}| %s| %s| %s| %s| {5}| %s| %s| %s| %s| {7}\r\n" % (
+        event, user, "", client, protocol, grant_type, role, status, adapter_id, description)).format
+
+
+AUTHN_START = audit_template(
+    event=constants.Events.AUTHENTICATION_ATTEMPT,
+    user="",
+    protocol="",
+    role=constants.Roles.IDP,
+    status=constants.Statuses.IN_PROGRESS
+)
+
+AUTHN_SUCCESS = audit_template(
+    event=constants.Events.AUTHENTICATION_ATTEMPT,
+    client="",
+    protocol="",
+    role=constants.Roles.IDP
+)
+
+AUTHN_FAILURE = audit_template(
+    event=constants.Events.AUTHENTICATION_ATTEMPT,
+    client="",
+    protocol="",
+    role=constants.Roles.IDP,
+    status=constants.Statuses.IN_PROGRESS
+)
+
+AUTHZ_CODE_REQUEST = audit_template(
+    grant_type=constants.GrantTypes.AUTH_CODE
+)
+
+AUTHZ_CODE_FAILURE = audit_template(
+    grant_type=constants.GrantTypes.AUTH_CODE,
+    status=constants.Statuses.FAILURE
+)
+
+AUTHZ_CODE_FAILURE_DESCRIPTIONS = [
+    constants.Errors.INVALID_CLIENT_ID,
+    constants.Errors.INVALID_SCOPE,
+    constants.Errors.INVALID_SECRET
+]
+
+AUTHZ_CODE_EXPIRY = audit_template(
+    grant_type=constants.GrantTypes.AUTH_CODE,
+    status=constants.Statuses.FAILURE,
+    description=constants.Errors.AUTHZ_CODE_EXPIRED
+)
+
+TOKEN_REQUEST = audit_template(
+    grant_type=constants.GrantTypes.AUTH_CODE,
+    adapter_id=""
+)
+
+INTROSPECTION = audit_template(
+    client=constants.Clients.RS_CLIENT,
+    adapter_id=""
+)
+
+INTROSPECTION_EXPIRY = audit_template(
+    client=constants.Clients.RS_CLIENT,
+    adapter_id="",
+    status=constants.Statuses.FAILURE,
+    description=constants.Errors.TOKEN_EXPIRED
+)
+
+VALIDATION = audit_template(
+    client=constants.Clients.RS_CLIENT,
+    grant_type=constants.GrantTypes.VALIDATE_BEARER,
+    adapter_id=""
+)
+
+VALIDATION_EXPIRY = audit_template(
+    client=constants.Clients.RS_CLIENT,
+    grant_type=constants.GrantTypes.VALIDATE_BEARER,
+    adapter_id="",
+    status=constants.Statuses.FAILURE,
+    description=constants.Errors.TOKEN_EXPIRED
+)
+
+REFRESH = audit_template(
+    grant_type=constants.GrantTypes.REFRESH,
+    adapter_id=""
+)
+
+REFRESH_TOKEN_FAILURE = audit_template(
+    grant_type=constants.GrantTypes.AUTH_CODE,
+    status=constants.Statuses.FAILURE,
+    adapter_id="",
+    description=constants.Errors.INVALID_REFRESH_TOKEN
+)
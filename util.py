@@ -1,11 +1,51 @@
-import string
-from random import randint, random, choice, getrandbits
+import base64
+import hashlib
+import math
+import random
 from ipaddress import IPv4Network, IPv4Address
 from datetime import datetime, timedelta
 
+import clock
 
-def timestamp():
-    return datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
+
+class Timestamp:
+    """
+    Formats times as log timestamps, e.g. 2018-09-18 05:30:15,666
+
+    strftime only runs when the second changes; within a second the cached prefix is reused and just
+    the milliseconds are appended.
+    """
+
+    MILLIS = ['%03d' % ms for ms in range(1000)]
+
+    def __init__(self, now=clock.now):
+        """
+        :param now: Callable returning the current epoch time, defaults to the installed clock.
+        """
+        self.now = now
+        # (second, prefix) swapped as one tuple so concurrent callers never see a mismatched pair
+        self._cache = (None, None)
+
+    def __call__(self, t=None):
+        """
+        :param t: Epoch time to format, defaults to now.
+        """
+        if t is None:
+            t = self.now()
+        second = math.floor(t)
+        # round to the microsecond like datetime.fromtimestamp, then truncate to milliseconds like %f[:-3]
+        us = round((t - second) * 1000000)
+        if us >= 1000000:
+            second += 1
+            us -= 1000000
+        cached, prefix = self._cache
+        if second != cached:
+            prefix = datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S,')
+            self._cache = (second, prefix)
+        return prefix + self.MILLIS[us // 1000]
+
+
+timestamp = Timestamp()
 
 
 def seconds_until(t=0):
@@ -15,7 +55,7 @@ def seconds_until(t=0):
     :param t: Integer from 0-23
     """
     d, t = divmod(t, 24)
-    now = datetime.now()
+    now = datetime.fromtimestamp(clock.now())
     target = datetime(year=now.year, month=now.month, day=now.day, hour=t)
     if t < now.hour:
         target += timedelta(days=1)
@@ -37,6 +77,13 @@ class Mock:
         'solsyspingfed10'
     ]
 
+    @staticmethod
+    def fleet(count):
+        """
+        Names for a fleet of count hosts, following HOSTS: solsyspingfed1, solsyspingfed2, ...
+        """
+        return ['solsyspingfed%d' % n for n in range(1, count + 1)]
+
     SUBNETS = [
         IPv4Network("10.0.0.0/8"),
         IPv4Network("172.16.0.0/12"),
@@ -81,7 +128,7 @@ class Mock:
 
     OAUTH_CLIENTS = [
         'analyzer',
-        'portal'
+        'portal',
         'api',
         'solsys_connect',
         'connect_api',
@@ -106,32 +153,54 @@ class Mock:
         'IWAAuth'
     ]
 
+    # Each mock value is drawn from rng, a random.Random stream (see rng() below), defaulting to the
+    # shared module-level one
+
     @staticmethod
-    def tid():
-        return ''.join(choice(string.ascii_letters + string.digits + '-_') for _ in range(27))
+    def tid(rng=random):
+        # 27 characters uniform over letters, digits, '-' and '_', i.e. the URL-safe base64 alphabet
+        return base64.urlsafe_b64encode(rng.getrandbits(168).to_bytes(21, 'big'))[:27].decode()
 
     @staticmethod
-    def response_time():
-        return randint(5, 100) if random() < 0.95 else randint(1000, 5000)
+    def response_time(rng=random):
+        return rng.randint(5, 100) if rng.random() < 0.95 else rng.randint(1000, 5000)
 
     @staticmethod
-    def host():
-        return choice(Mock.HOSTS)
+    def host(rng=random):
+        return rng.choice(Mock.HOSTS)
 
     @staticmethod
-    def ip_address():
-        subnet = choice(Mock.SUBNETS)
-        bits = getrandbits(subnet.max_prefixlen - subnet.prefixlen)
+    def ip_address(rng=random):
+        subnet = rng.choice(Mock.SUBNETS)
+        bits = rng.getrandbits(subnet.max_prefixlen - subnet.prefixlen)
         return str(IPv4Address(subnet.network_address + bits))
 
     @staticmethod
-    def user():
-        return '%s.%s@%s' % (choice(Mock.FIRST_NAMES), choice(Mock.LAST_NAMES), choice(Mock.EMAIL_DOMAINS))
+    def user(rng=random):
+        return '%s.%s@%s' % (rng.choice(Mock.FIRST_NAMES), rng.choice(Mock.LAST_NAMES),
+                             rng.choice(Mock.EMAIL_DOMAINS))
 
     @staticmethod
-    def client():
-        return choice(Mock.OAUTH_CLIENTS)
+    def client(rng=random):
+        return rng.choice(Mock.OAUTH_CLIENTS)
 
     @staticmethod
-    def adapter():
-        return choice(Mock.ADAPTERS)
+    def adapter(rng=random):
+        return rng.choice(Mock.ADAPTERS)
+
+
+SEED = None  # Set for reproducible output, see rng()
+
+
+def rng(*key):
+    """
+    Independent random stream for one part of the generator, named by key, e.g. rng('host', 'solsyspingfed1').
+
+    With SEED set the stream is derived from the seed and key alone, so it is the same on every run
+    whichever order streams are created in and whichever process creates them. Otherwise it is seeded
+    from the OS.
+    """
+    if SEED is None:
+        return random.Random()
+    digest = hashlib.sha256(repr((SEED,) + key).encode()).digest()
+    return random.Random(int.from_bytes(digest, 'big'))
@@ -0,0 +1,412 @@
+import collections
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import constants
+import metrics
+import sinks
+
+
+class LogWriter(threading.Thread):
+    """
+    Writes queued log records to a sink (a file unless another is given) from a dedicated thread.
+
+    Records are drained from the queue in batches and held in memory until flush_size bytes are
+    buffered or flush_interval seconds have passed, then handed to the sink in a single write.
+
+    The queue holds at most max_queue records (unbounded if 0). When it is full, write() applies the
+    overflow policy (see constants.Overflow): block until there is room, drop the oldest queued record,
+    drop the new record, or spill it to a file next to the log, which is written out in order once the
+    queue has drained. Blocked, dropped and spilled records are counted.
+
+    One in Metrics.WRITE_SAMPLE write() calls is timed, as is every flush to the sink.
+    """
+
+    batch_size = 1024  # Maximum number of records taken off the queue at once
+
+    def __init__(self, log_file, flush_size=64 * 1024, flush_interval=0.2, shared=False, max_queue=0,
+                 overflow=constants.Overflow.BLOCK, sink=None):
+        """
+        :param sink: Sink to write to, defaults to appending to log_file. The spill file is kept next to
+                     log_file either way.
+        """
+        threading.Thread.__init__(self)
+        self._queue = queue.Queue(max_queue)
+        self.log_file = log_file
+        self._stop_event = threading.Event()
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self.sink = sink if sink is not None else sinks.FileSink(log_file, shared)
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.records = 0  # Total records written, read by the rate controller
+        self.blocked = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.bytes = 0  # Total bytes handed to the sink
+        self.write_latency = metrics.Histogram()
+        self.flush_latency = metrics.Histogram()
+        self._spill_lock = threading.Lock()
+        self._spill_file = None
+        self._spilling = False
+        self.setDaemon(True)
+        self.start()
+
+    def run(self):
+        buffer = []
+        buffered = 0
+        last_flush = time.monotonic()
+        try:
+            self.sink.open()
+            # Keep draining after a stop so that stop() can join the queue
+            while not self._stop_event.is_set() or not self._queue.empty() or self._spilling:
+                timeout = self.flush_interval - (time.monotonic() - last_flush) if buffer else 1
+                for record in self._batch(max(timeout, 0)):
+                    buffer.append(record)
+                    buffered += len(record)
+                # Spilled records are newer than anything taken off the queue so far
+                spilled = self._unspill() if self._spilling and self._queue.empty() else b''
+                if spilled or buffer and (buffered >= self.flush_size
+                                          or time.monotonic() - last_flush >= self.flush_interval
+                                          or self._stop_event.is_set()):
+                    self._flush(buffer, spilled)
+                    buffered = 0
+                    last_flush = time.monotonic()
+                elif not buffer:
+                    last_flush = time.monotonic()
+        except IOError as e:
+            print(e)
+        finally:
+            try:
+                self._flush(buffer)
+            except IOError as e:
+                print(e)
+            self.sink.close()
+            if self._spill_file is not None:
+                self._spill_file.close()
+                os.remove(self._spill_file.name)
+
+    def stop(self):
+        self._stop_event.set()
+        self._queue.join()
+
+    def write(self, p, count=1):
+        """
+        :param p: Record to write.
+        :param count: Number of lines in p when several are written as one record. They're counted as
+                      records, but overflow policies apply to them as one.
+        """
+        self.records += count
+        if self.records % constants.Metrics.WRITE_SAMPLE:
+            self._put(p)
+            return
+        start = time.perf_counter()
+        self._put(p)
+        self.write_latency.observe(time.perf_counter() - start)
+
+    def counters(self):
+        return {
+            'records': self.records,
+            'bytes': self.bytes,
+            'blocked': self.blocked,
+            'dropped': self.dropped,
+            'spilled': self.spilled
+        }
+
+    def backlog(self):
+        """
+        Number of records waiting on the queue for the writer thread.
+        """
+        return self._queue.qsize()
+
+    def _batch(self, timeout):
+        """
+        Block for up to timeout seconds for a record, then take whatever else is already queued.
+        """
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        try:
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _put(self, p):
+        if self._spilling:
+            with self._spill_lock:
+                if self._spilling:  # Keep order until the spill file has been written out
+                    self._spill(p)
+                    return
+        try:
+            self._queue.put_nowait(p)
+        except queue.Full:
+            self._overflow(p)
+
+    def _overflow(self, p):
+        """
+        Apply the overflow policy to a record which didn't fit on the queue.
+        """
+        if self.overflow == constants.Overflow.DROP_NEWEST:
+            self.dropped += 1
+        elif self.overflow == constants.Overflow.DROP_OLDEST:
+            while True:
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+                try:
+                    self._queue.put_nowait(p)
+                    return
+                except queue.Full:
+                    pass
+        elif self.overflow == constants.Overflow.SPILL:
+            with self._spill_lock:
+                self._spill(p)
+                self._spilling = True
+        else:
+            self.blocked += 1
+            self._queue.put(p)
+
+    def _spill(self, p):
+        if self._spill_file is None:
+            self._spill_file = open('%s.%d.spill' % (self.log_file, os.getpid()), 'w+b')
+        self._spill_file.write(p.encode())
+        self.spilled += 1
+
+    def _unspill(self):
+        """
+        Take the contents of the spill file, after which records go back on the queue.
+        """
+        with self._spill_lock:
+            self._spill_file.flush()
+            self._spill_file.seek(0)
+            data = self._spill_file.read()
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+            self._spilling = False
+        return data
+
+    def _flush(self, buffer, spilled=b''):
+        """
+        Write buffered records, followed by any spilled ones, in one call and mark the buffered records done
+        on the queue.
+
+        :return: Number of bytes written.
+        """
+        if not buffer and not spilled:
+            return 0
+        data = ''.join(buffer).encode() + spilled
+        start = time.perf_counter()
+        try:
+            written = self.sink.write(data)
+            self.flush_latency.observe(time.perf_counter() - start)
+            self.bytes += len(data)
+            return written
+        finally:
+            for n in range(len(buffer)):
+                self._queue.task_done()
+            del buffer[:]
+
+
+class AsyncLogWriter:
+    """
+    LogWriter for the asyncio runtime, written to by flows on the event loop.
+
+    Records are buffered on the loop until flush_size bytes are buffered or flush_interval seconds have
+    passed. Each batch is then written to the sink on a worker thread, one batch at a time so they land
+    in order, leaving the loop free to keep generating.
+
+    max_queue bounds the records buffered and being written, and the overflow policy applies once it is
+    reached as it does for LogWriter. Blocking waits for the batch being written, holding up the loop.
+    """
+
+    def __init__(self, loop, log_file, flush_size=64 * 1024, flush_interval=0.2, shared=False, max_queue=0,
+                 overflow=constants.Overflow.BLOCK, sink=None):
+        """
+        :param loop: Event loop write() is called on.
+        """
+        self.loop = loop
+        self.log_file = log_file
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self.sink = sink if sink is not None else sinks.FileSink(log_file, shared)
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.records = 0
+        self.blocked = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.bytes = 0
+        self.write_latency = metrics.Histogram()
+        self.flush_latency = metrics.Histogram()
+        self._buffer = collections.deque()
+        self._buffered = 0
+        self._in_flight = None  # Future of the batch being written
+        self._in_flight_records = 0
+        self._timer = None
+        self._spill_file = None
+        self._spilling = False
+        self._executor = ThreadPoolExecutor(1)
+        self._executor.submit(self.sink.open)
+
+    def write(self, p, count=1):
+        """
+        :param p: Record to write.
+        :param count: Number of lines in p, see LogWriter.write.
+        """
+        self.records += count
+        if self.records % constants.Metrics.WRITE_SAMPLE:
+            self._put(p)
+            return
+        start = time.perf_counter()
+        self._put(p)
+        self.write_latency.observe(time.perf_counter() - start)
+
+    def stop(self):
+        """
+        Write out everything still buffered. Only call once the event loop has stopped.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._in_flight is not None or self._buffer or self._spilling:
+            if self._in_flight is not None:
+                self._wait()
+            else:
+                self._flush()
+        self._executor.submit(self.sink.close).result()
+        if self._spill_file is not None:
+            self._spill_file.close()
+            os.remove(self._spill_file.name)
+
+    def join(self):
+        self._executor.shutdown()
+
+    def counters(self):
+        return {
+            'records': self.records,
+            'bytes': self.bytes,
+            'blocked': self.blocked,
+            'dropped': self.dropped,
+            'spilled': self.spilled
+        }
+
+    def backlog(self):
+        """
+        Number of records buffered or being written.
+        """
+        return len(self._buffer) + self._in_flight_records
+
+    def _put(self, p):
+        if self._spilling:
+            self._spill(p)  # Keep order until the spill file has been written out
+            return
+        if self.max_queue and self.backlog() >= self.max_queue and not self._overflow(p):
+            return
+        self._buffer.append(p)
+        self._buffered += len(p)
+        if self._buffered >= self.flush_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = self.loop.call_later(self.flush_interval, self._flush)
+
+    def _overflow(self, p):
+        """
+        Apply the overflow policy to a record which doesn't fit.
+
+        :return: True if the record should still be buffered.
+        """
+        if self.overflow == constants.Overflow.DROP_NEWEST:
+            self.dropped += 1
+            return False
+        if self.overflow == constants.Overflow.DROP_OLDEST:
+            self.dropped += 1
+            if not self._buffer:
+                return False  # Everything older is already being written
+            self._buffered -= len(self._buffer.popleft())
+            return True
+        if self.overflow == constants.Overflow.SPILL:
+            self._spill(p)
+            self._spilling = True
+            return False
+        self.blocked += 1
+        while self.backlog() >= self.max_queue:
+            if self._in_flight is not None:
+                self._wait()
+            else:
+                self._flush()
+        return True
+
+    def _spill(self, p):
+        if self._spill_file is None:
+            self._spill_file = open('%s.%d.spill' % (self.log_file, os.getpid()), 'w+b')
+        self._spill_file.write(p.encode())
+        self.spilled += 1
+
+    def _unspill(self):
+        self._spill_file.flush()
+        self._spill_file.seek(0)
+        data = self._spill_file.read()
+        self._spill_file.seek(0)
+        self._spill_file.truncate()
+        self._spilling = False
+        return data
+
+    def _flush(self):
+        """
+        Hand the buffered records, followed by any spilled ones, to the worker thread, unless a batch is
+        already being written, in which case they follow it.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._in_flight is not None:
+            return
+        spilled = self._unspill() if self._spilling else b''
+        if not self._buffer and not spilled:
+            return
+        data = ''.join(self._buffer).encode() + spilled
+        self._in_flight_records = len(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+        self._in_flight = future = self._executor.submit(self._write, data)
+        future.add_done_callback(lambda f: self.loop.call_soon_threadsafe(self._written, f))
+
+    def _write(self, data):
+        """
+        Write a batch to the sink, on the worker thread.
+        """
+        start = time.perf_counter()
+        written = self.sink.write(data)
+        self.flush_latency.observe(time.perf_counter() - start)
+        self.bytes += len(data)
+        return written
+
+    def _wait(self):
+        """
+        Block until the batch being written has landed.
+        """
+        future = self._in_flight
+        concurrent.futures.wait([future])
+        self._written(future)
+
+    def _written(self, future):
+        if future is not self._in_flight:
+            return  # Already handled by _wait
+        self._in_flight = None
+        self._in_flight_records = 0
+        if future.exception() is not None:
+            print(future.exception())
+        if self._buffered >= self.flush_size or self._buffer and self._timer is None or self._spilling:
+            self._flush()